@@ -10,15 +10,26 @@ import discord
 from logging.handlers import RotatingFileHandler
 from discord.ext import commands
 from dotenv import load_dotenv, find_dotenv
+from utils import db
 from utils.context import DiscordContext
-from utils.config import ConfigManager, MaxConcurrency, GuildConfig, UserConfig, StringsField
+from utils.config import (ConfigManager, ConfigInvalidationListener, MaxConcurrency, GuildConfig,
+                          UserConfig, StringsField, IntsField, ChannelField, GuildStateVersions)
 from utils.help import NewHelpCommand
+from utils.http import ValidatorCache
+from utils.events import EVENTS_SCHEMA
+from utils.jobs import JOBS_SCHEMA
+from utils.messages import MESSAGES_SCHEMA
+from utils.migrations import MigrationEngine
+from utils.prefixes import PrefixTable
+from utils.validation import ConfigValidationSweep, ISSUES_SCHEMA
 from utils.checks import guild_owner_or_permissions
 from utils.utils import get_color_from_hex_string
 
 load_dotenv(find_dotenv(), override=True)
 logger = logging.getLogger(__name__)
 DEFAULT_PREFIX = os.environ.get('DEFAULT_COMMAND_PREFIX', '!')
+# Seconds config updates are held back and written in batches. Unset writes them immediately.
+CONFIG_WRITE_BEHIND = float(os.environ['CONFIG_WRITE_BEHIND']) if os.environ.get('CONFIG_WRITE_BEHIND') else None
 intents = discord.Intents.all()
 
 cogs = (
@@ -27,16 +38,17 @@ cogs = (
 )
 
 
-async def get_prefix(bot, message):
+def get_prefix(bot, message):
+    # Returns the prebuilt prefixes when they are known, otherwise a
+    # coroutine fetching them which discord.py awaits.
     if message.guild is None:
-        prefixes = (DEFAULT_PREFIX,)
-    else:
-        prefixes = await bot.main_config.safe_fetch_field(
-            message.guild.id,
-            'prefixes',
-        )
+        return bot.prefixes.default_prefixes
 
-    return commands.when_mentioned_or(*prefixes)(bot, message)
+    prefixes = bot.prefixes.get(message.guild.id)
+    if prefixes is None:
+        return bot.prefixes.fetch(message.guild.id)
+
+    return prefixes
 
 
 @guild_owner_or_permissions(administrator=True)
@@ -66,6 +78,11 @@ class OWNotifierBot(commands.Bot):
         )
 
         self.pool = None
+        self.migrations = None
+        self.config_listener = None
+        self.prefixes = None
+        self.validation_sweep = None
+        self.guild_state = GuildStateVersions()
         self.guild_config_manager = ConfigManager(self)
         self.user_config_manager = ConfigManager(self)
 
@@ -79,7 +96,7 @@ class OWNotifierBot(commands.Bot):
         return await super().get_context(message, cls=cls or DiscordContext)
 
     async def load_other(self):
-        self.main_config = cfg = GuildConfig(self, 'main')
+        self.main_config = cfg = GuildConfig(self, 'main', write_behind=CONFIG_WRITE_BEHIND)
         cfg.add_field(StringsField(
             'prefixes',
             'Prefixes',
@@ -87,12 +104,33 @@ class OWNotifierBot(commands.Bot):
             min_size=1,
             max_size=30,
         ))
+        cfg.add_field(ChannelField(
+            'notification_channel',
+            'Notification channel',
+            default_value=None,
+            description='The channel events are posted to. Nothing is posted if no channel is set.',
+        ))
+        cfg.add_field(IntsField(
+            'organizers',
+            'Organizers',
+            max_strings=20,
+            max_size=10,
+            description='Only post events by these organizer ids. Posts every event if neither '
+                        'organizers nor keywords are set.',
+        ))
+        cfg.add_field(StringsField(
+            'keywords',
+            'Keywords',
+            max_strings=20,
+            description='Only post events with one of these keywords in the title.',
+        ))
         cfg.setup()
 
+        self.prefixes = PrefixTable(self, cfg, 'prefixes', (DEFAULT_PREFIX,))
         self.guild_config_manager.add_config(cfg)
         self.add_command(config_command)
 
-        self.ow_user_config = cfg = UserConfig(self, 'ow_user')
+        self.ow_user_config = cfg = UserConfig(self, 'ow_user', write_behind=CONFIG_WRITE_BEHIND)
         cfg.add_field(StringsField(
             'testfield',
             'TestField',
@@ -100,6 +138,19 @@ class OWNotifierBot(commands.Bot):
             min_size=1,
             max_size=30,
         ))
+        cfg.add_field(IntsField(
+            'organizers',
+            'Organizers',
+            max_strings=20,
+            max_size=10,
+            description='Get a DM about events by these organizer ids.',
+        ))
+        cfg.add_field(StringsField(
+            'keywords',
+            'Keywords',
+            max_strings=20,
+            description='Get a DM about events with one of these keywords in the title.',
+        ))
         cfg.setup()
 
         self.user_config_manager.add_config(cfg)
@@ -122,6 +173,29 @@ class OWNotifierBot(commands.Bot):
         if not hasattr(self, "uptime"):
             self.uptime = datetime.datetime.utcnow()
 
+        try:
+            await self.guild_config_manager.prewarm(g.id for g in self.guilds)
+        except Exception:
+            logger.exception('Failed to prewarm guild configs.')
+
+    async def on_guild_join(self, guild):
+        await self.guild_config_manager.prewarm((guild.id,))
+
+    async def on_guild_remove(self, guild):
+        self.guild_config_manager.evict(guild.id)
+
+    async def on_guild_role_update(self, before, after):
+        self.guild_state.bump(after.guild.id, 'roles')
+
+    async def on_guild_role_delete(self, role):
+        self.guild_state.bump(role.guild.id, 'roles')
+
+    async def on_guild_channel_update(self, before, after):
+        self.guild_state.bump(after.guild.id, 'channels')
+
+    async def on_guild_channel_delete(self, channel):
+        self.guild_state.bump(channel.guild.id, 'channels')
+
     def setup_logging(self):
         logger.info('Setting up logging.')
 
@@ -146,42 +220,49 @@ class OWNotifierBot(commands.Bot):
         logger.info(f'Added logger {log.name}.')
 
     async def setup_db(self):
-        self.pool = await asyncpg.create_pool(
+        self.db_options = dict(
             host=os.environ['POSTGRES_HOST'],
             port=os.environ.get('POSTGRES_PORT', 5432),
             user=os.environ.get('POSTGRES_USER', 'postgres'),
             password=os.environ.get('POSTGRES_PASSWORD'),
             database=os.environ.get('POSTGRES_DATABASE', 'postgres'),
         )
+        self.pool = await asyncpg.create_pool(**self.db_options, init=db.init_connection)
         print("Database connection established.")
 
-        statements = [
-            (
-                'CREATE TABLE IF NOT EXISTS ow_events ('
-                'id INTEGER PRIMARY KEY,'
-                'title TEXT,'
-                'description TEXT,'
-                'start_date TIMESTAMP,'
-                'end_date TIMESTAMP,'
-                'organizer INT,'
-                'last_updated TIMESTAMP'
-                ')'
-            ),
-        ]
-        if statements:
-            async with self.pool.acquire() as con:
-                await con.execute('\n'.join(statements))
-                logger.info('Created necessary database tables.')
+        self.migrations = MigrationEngine(self)
+        await self.migrations.migrate_all((EVENTS_SCHEMA, JOBS_SCHEMA, MESSAGES_SCHEMA, ISSUES_SCHEMA))
+        logger.info('Created necessary database tables.')
 
     async def close_db(self):
+        if self.validation_sweep is not None:
+            self.validation_sweep.stop()
+        if self.config_listener is not None:
+            await self.config_listener.close()
+
+        # Writes updates still held back by write-behind.
+        await self.guild_config_manager.flush()
+        await self.user_config_manager.flush()
         await self.pool.close()
 
     async def init_application(self):
+        self.session = aiohttp.ClientSession()
+        self.http_cache = ValidatorCache(self.session)
+
         await self.setup_db()
         await self.load_other()
-        await self.load_cogs()
 
-        self.session = aiohttp.ClientSession()
+        self.config_listener = ConfigInvalidationListener(
+            self,
+            (self.guild_config_manager, self.user_config_manager),
+            self.db_options,
+        )
+        await self.config_listener.start()
+
+        self.validation_sweep = ConfigValidationSweep(self, (self.guild_config_manager,))
+        self.validation_sweep.start()
+
+        await self.load_cogs()
 
     async def shutdown_application(self):
         tasks = [self.close_db()]
@@ -218,6 +299,14 @@ class OWNotifierBot(commands.Bot):
             logger.info('Graceful shutdown complete.')
 
     async def close(self):
+        # Extensions are unloaded before the database is closed, so cogs can
+        # still use it while they finish their work.
+        for extension in tuple(self.extensions):
+            try:
+                await self.unload_extension(extension)
+            except Exception:
+                logger.exception(f'Failed to unload extension {extension}.')
+
         await self.process_close()
         await super().close()
 
@@ -139,6 +139,50 @@ class AdminCog(commands.Cog):
                 header=True
             )
 
+    @commands.is_owner()
+    @commands.hybrid_command()
+    async def cachestats(self, ctx):
+        entries = []
+        managers = (self.bot.guild_config_manager, self.bot.user_config_manager)
+        for cfg in (c for m in managers for c in m.configs):
+            stats = cfg.stats
+            cache = stats['cache']
+            entries.append({
+                'config': cfg.table_name,
+                'size': cache['size'],
+                'bytes': cache['bytes'],
+                'hit ratio': f'{cache["hit_ratio"]:.1%}',
+                'evictions': cache['evictions'],
+                'expirations': cache['expirations'],
+                'coalesced': stats['coalesced'],
+            })
+
+        await ctx.send_as_table_display(entries)
+
+    @commands.is_owner()
+    @commands.hybrid_command()
+    async def invalidconfigs(self, ctx, sweep: Optional[bool] = False):
+        """Shows the configs found invalid by the last validation sweep.
+        Pass true to run a sweep first."""
+        if sweep:
+            await self.bot.validation_sweep.run()
+
+        entries = []
+        for row in await self.bot.validation_sweep.fetch_issues():
+            guild = self.bot.get_guild(row['identifier'])
+            entries.append({
+                'config': row['config'],
+                'identifier': row['identifier'],
+                'guild': guild.name if guild is not None else '',
+                'fields': ', '.join(row['invalid_fields']),
+                'checked': row['checked_at'].strftime('%Y-%m-%d %H:%M'),
+            })
+
+        if not entries:
+            return await ctx.send_formatted('No invalid configs found.')
+
+        await ctx.send_as_table_display(entries)
+
     @commands.is_owner()
     @commands.hybrid_group(aliases=['db'])
     async def database(self, ctx):
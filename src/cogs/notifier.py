@@ -1,58 +1,344 @@
+import aiohttp
 import asyncio
 import datetime
+import logging
+import math
+import os
+import discord
+import functools
 import traceback
 
 from discord.ext import commands
+from utils.config import InvalidValue
+from utils.dispatcher import NotificationDispatcher, Priority
+from utils.events import EventStore, normalize_event
+from utils.jobs import JobStore
+from utils.messages import NotificationMessageStore
+from utils.render import EmbedRenderCache
+from utils.scheduler import PollScheduler, Reminder, ReminderScheduler
+from utils.subscriptions import SubscriptionIndex
+
+logger = logging.getLogger(__name__)
+
+EVENTS_URL = 'https://old.online.ntnu.no/api/v1/event/events/'
+
+# (kind, event column, how long before the instant the reminder fires, priority, header)
+REMINDERS = (
+    ('start', 'start_date', datetime.timedelta(hours=1), Priority.HIGH, 'Starting soon'),
+    ('registration', 'registration_start', datetime.timedelta(hours=1), Priority.URGENT, 'Registration opens soon'),
+)
 
 
 class NotifierCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.cached_tzinfo = None
+        self.event_store = EventStore(bot)
+        self.fetch_concurrency = int(os.environ.get('EVENTS_FETCH_CONCURRENCY', 4))
+        self.fetch_retries = int(os.environ.get('EVENTS_FETCH_RETRIES', 3))
+        self.fetch_semaphore = asyncio.Semaphore(self.fetch_concurrency)
+        self.poll_scheduler = PollScheduler(
+            min_interval=int(os.environ.get('POLL_MIN_INTERVAL', 30)),
+            max_interval=int(os.environ.get('POLL_MAX_INTERVAL', 30 * 60)),
+        )
+        self.job_store = JobStore(bot)
+        self.job_window = datetime.timedelta(hours=6)
+        self.reminder_scheduler = ReminderScheduler(self.fire_reminders)
+        self.reminder_scheduler.start()
+        self.subscriptions = SubscriptionIndex()
+        self._guild_channels = {}
+        self.dispatcher = NotificationDispatcher(
+            bot,
+            workers=int(os.environ.get('NOTIFICATION_WORKERS', 4)),
+        )
+        self.dispatcher.start()
+        self.render_cache = EmbedRenderCache(color=bot.color)
+        self.message_store = NotificationMessageStore(bot)
+        self.bot.main_config.add_update_listener(self.on_guild_config_update)
+        self.bot.ow_user_config.add_update_listener(self.on_user_config_update)
         self.updater_task = asyncio.create_task(self.updater_runner())
 
     async def cog_unload(self):
         self.updater_task.cancel()
+        self.reminder_scheduler.stop()
+        await self.dispatcher.stop()
+        self.bot.main_config.remove_update_listener(self.on_guild_config_update)
+        self.bot.ow_user_config.remove_update_listener(self.on_user_config_update)
+
+    @staticmethod
+    def _get_raw_organizers(values):
+        # Configs stored before organizers were validated can hold entries
+        # which aren't ids. They load as an InvalidValue holding the raw list,
+        # or None if the column is NULL.
+        if isinstance(values, InvalidValue):
+            return values.value or []
+        return values
+
+    @classmethod
+    def _parse_organizers(cls, values):
+        organizers = []
+        for value in cls._get_raw_organizers(values):
+            try:
+                organizers.append(int(value))
+            except (TypeError, ValueError):
+                pass
+
+        return organizers
+
+    def _set_guild_subscription(self, guild_id, channel_id, organizers, keywords):
+        subscriber = ('guild', guild_id)
+        if channel_id is None:
+            self._guild_channels.pop(guild_id, None)
+            self.subscriptions.remove(subscriber)
+            return
+
+        self._guild_channels[guild_id] = channel_id
+
+        # An organizer filter without any usable ids matches nothing rather
+        # than everything.
+        match_all = not (self._get_raw_organizers(organizers) or keywords)
+        self.subscriptions.set(
+            subscriber,
+            organizers=self._parse_organizers(organizers),
+            keywords=keywords,
+            match_all=match_all,
+        )
+
+    def _set_user_subscription(self, user_id, organizers, keywords):
+        self.subscriptions.set(
+            ('user', user_id),
+            organizers=self._parse_organizers(organizers),
+            keywords=keywords,
+        )
+
+    def _get_destination(self, subscriber):
+        kind, id_ = subscriber
+        if kind == 'user':
+            return subscriber
+
+        channel_id = self._guild_channels.get(id_)
+        if channel_id is not None:
+            return ('channel', channel_id)
+
+    def notify(self, events, header=None, priority=Priority.NORMAL, track=False):
+        """Queues a notification about each event for all of its subscribers.
+
+        If ``track`` is true, the posted messages are stored so later
+        updates of the event can be edited into them.
+        """
+        for event in events:
+            subscribers = self.subscriptions.match(event)
+            if not subscribers:
+                continue
+
+            embed = self.render_cache.get_embed(event, header=header, tzinfo=self.cached_tzinfo)
+            for subscriber in subscribers:
+                destination = self._get_destination(subscriber)
+                if destination is None:
+                    continue
+
+                callback = None
+                if track:
+                    callback = functools.partial(self.message_store.add, event['id'], destination)
+
+                self.dispatcher.enqueue(destination, priority=priority, embed=embed, callback=callback)
+
+    async def notify_updates(self, events, header=None, priority=Priority.NORMAL):
+        """Edits the messages already posted about each event and posts new
+        ones to subscribers that have not got one."""
+        tracked = await self.message_store.get_many([e['id'] for e in events])
+        for event in events:
+            embed = self.render_cache.get_embed(event, header=header, tzinfo=self.cached_tzinfo)
+            messages = tracked[event['id']]
+
+            for destination, (channel_id, message_id) in messages.items():
+                async def error_callback(error, event_id=event['id'], destination=destination):
+                    if isinstance(error, (discord.NotFound, discord.Forbidden)):
+                        await self.message_store.remove(event_id, destination)
+
+                self.dispatcher.enqueue(
+                    destination,
+                    priority=priority,
+                    edit=(channel_id, message_id),
+                    embed=embed,
+                    error_callback=error_callback,
+                )
+
+            for subscriber in self.subscriptions.match(event):
+                destination = self._get_destination(subscriber)
+                if destination is None or destination in messages:
+                    continue
+
+                self.dispatcher.enqueue(
+                    destination,
+                    priority=priority,
+                    embed=embed,
+                    callback=functools.partial(self.message_store.add, event['id'], destination),
+                )
+
+    @commands.Cog.listener()
+    async def on_ow_event_reminders(self, reminders):
+        headers = {kind: (priority, header) for kind, _, _, priority, header in REMINDERS}
+        for reminder in reminders:
+            priority, header = headers[reminder.key[1]]
+            self.notify((reminder.payload,), header=header, priority=priority)
+
+    async def load_subscriptions(self):
+        keys = ('notification_channel', 'organizers', 'keywords')
+        cfg = self.bot.main_config
+        for row in await cfg.fetch_all_configs(keys):
+            self._set_guild_subscription(
+                row['identifier'],
+                row['notification_channel'],
+                cfg.get_field('organizers').load(None, row['organizers']),
+                cfg.get_field('keywords').load(None, row['keywords']),
+            )
+
+        keys = ('organizers', 'keywords')
+        cfg = self.bot.ow_user_config
+        for row in await cfg.fetch_all_configs(keys):
+            self._set_user_subscription(
+                row['identifier'],
+                cfg.get_field('organizers').load(None, row['organizers']),
+                cfg.get_field('keywords').load(None, row['keywords']),
+            )
+
+    async def on_guild_config_update(self, identifier, keys):
+        data = await self.bot.main_config.fetch_and_load_config(identifier)
+        channel = data['notification_channel']
+        self._set_guild_subscription(
+            identifier,
+            channel.id if isinstance(channel, discord.abc.GuildChannel) else None,
+            data['organizers'],
+            data['keywords'],
+        )
+
+    async def on_user_config_update(self, identifier, keys):
+        data = await self.bot.ow_user_config.fetch_and_load_config(identifier)
+        self._set_user_subscription(identifier, data['organizers'], data['keywords'])
+
+    async def schedule_reminders(self, events):
+        now = datetime.datetime.utcnow()
+        window_end = now + self.job_window
+
+        jobs = []
+        cancelled = []
+        for event in events:
+            for kind, column, before, *_ in REMINDERS:
+                key = (event['id'], kind)
+                instant = event[column]
+                if instant is None or instant - before <= now:
+                    cancelled.append(key)
+                    self.reminder_scheduler.cancel(key)
+                    continue
+
+                fire_at = instant - before
+                jobs.append((event['id'], kind, fire_at))
+
+                # Jobs outside the window are picked up by load_reminders() later.
+                if fire_at > window_end:
+                    self.reminder_scheduler.cancel(key)
+                    continue
+
+                current = self.reminder_scheduler.get(key)
+                if current is None or current.fire_at != fire_at:
+                    self.reminder_scheduler.schedule(key, fire_at)
+
+        async with self.bot.pool.acquire() as con:
+            async with con.transaction():
+                await self.job_store.cancel(cancelled, con=con)
+                await self.job_store.schedule(jobs, con=con)
+
+    async def load_reminders(self):
+        """Loads the jobs of the next window into the reminder scheduler."""
+        jobs = await self.job_store.fetch_window(datetime.datetime.utcnow() + self.job_window)
+        for job in jobs:
+            key = (job['event_id'], job['kind'])
+            current = self.reminder_scheduler.get(key)
+            if current is None or current.fire_at != job['fire_at']:
+                self.reminder_scheduler.schedule(key, job['fire_at'])
+
+    async def _handle_jobs(self, jobs, con):
+        events = await self.event_store.fetch_events_by_ids(
+            {j['event_id'] for j in jobs},
+            con=con,
+        )
+
+        now = datetime.datetime.utcnow()
+        columns = {kind: column for kind, column, *_ in REMINDERS}
+
+        reminders = []
+        for job in jobs:
+            event = events.get(job['event_id'])
+
+            # Jobs missed while the bot was down are dropped once the
+            # instant they remind about has passed, and so are jobs whose
+            # instant was removed. Both are still marked as done.
+            if event is None:
+                continue
+
+            instant = event[columns[job['kind']]]
+            if instant is None or instant <= now:
+                continue
+
+            reminders.append(Reminder((job['event_id'], job['kind']), job['fire_at'], event))
+
+        if reminders:
+            self.bot.dispatch('ow_event_reminders', reminders)
+
+    async def fire_reminders(self, reminders):
+        # The in-memory reminders only tell us when to look, the job table
+        # decides what is actually due and not already claimed elsewhere.
+        await self.job_store.run_due(datetime.datetime.utcnow(), self._handle_jobs)
+
+    async def get_next_poll_delay(self):
+        now = datetime.datetime.utcnow()
+        next_instant = await self.event_store.fetch_next_instant(
+            self.poll_scheduler.window_start(now),
+        )
+        return self.poll_scheduler.next_delay(next_instant, now=now)
 
     async def updater_runner(self):
         try:
-            while True:
-                await self.updater()
-                await asyncio.sleep(5 * 60)
+            await self.load_subscriptions()
         except Exception:
-            traceback.print_exc()
+            logger.exception('Failed to load subscriptions.')
 
-    async def _insert_event(self, event, exists: bool = False):
-        async with self.bot.pool.acquire() as conn:
-            if not exists:
-                await conn.execute(
-                    'INSERT INTO events (id, title, description, start_date, end_date, organizer, last_updated) '
-                    'VALUES ($1, $2, $3, $4, $5, $6, $7)',
-                    event['id'],
-                    event['title'],
-                    event['description'],
-                    event['start_date'],
-                    event['end_date'],
-                    event['organizer'],
-                    datetime.datetime.now(),
-                )
-            else:
-                await conn.execute(
-                    'UPDATE events SET title=$1, description=$2, start_date=$3, end_date=$4, organizer=$5, last_updated=$6 '
-                    'WHERE id=$7',
-                    event['title'],
-                    event['description'],
-                    event['start_date'],
-                    event['end_date'],
-                    event['organizer'],
-                    datetime.datetime.now(),
-                    event['id'],
-                )
+        while True:
+            try:
+                await self.updater()
+            except Exception:
+                logger.exception('Failed to update events.')
+
+            try:
+                await self.load_reminders()
+            except Exception:
+                logger.exception('Failed to load reminders.')
+
+            try:
+                delay = await self.get_next_poll_delay()
+            except Exception:
+                logger.exception('Failed to schedule the next poll.')
+                delay = self.poll_scheduler.max_interval
+
+            await asyncio.sleep(delay)
 
     async def updater(self):
-        events = await self.fetch_events()
-        for event in events:
-            await self._insert_event(event)
+        events = [normalize_event(e) for e in await self.fetch_events()]
+        changes = await self.event_store.store_changed_events(events)
+        logger.info(
+            f'Fetched {len(events)} events: {len(changes.new)} new, '
+            f'{len(changes.updated)} updated, {changes.unchanged} unchanged.'
+        )
+
+        await self.schedule_reminders(changes)
+
+        self.render_cache.evict_past()
+        self.message_store.retain(e['id'] for e in events)
+        self.notify(changes.new, header='New event', track=True)
+        await self.notify_updates(changes.updated, header='Event updated')
+
+        return changes
 
     def get_datetime_with_timezone(self, tzinfo: datetime.timezone | None = None) -> datetime.datetime:
         if tzinfo is None:
@@ -60,36 +346,83 @@ class NotifierCog(commands.Cog):
 
         return datetime.datetime.now(tzinfo)
 
-    async def fetch_events(self, page: int = 1, page_size: int = 80) -> list:
-        print("Requesting")
-        async with self.bot.session.get(
-            'https://old.online.ntnu.no/api/v1/event/events/',
-            params={
-                'format': 'json',
-                'page': 1,
-                'page_size': page_size,
-                'ordering': '-event_start'
-            },
-        ) as response:
-            data = await response.json()
-
-        results = data['results']
-        if results:
-            start_date = datetime.datetime.fromisoformat(results[-1]['start_date'])
-            if self.cached_tzinfo is None:
-                self.cached_tzinfo = start_date.tzinfo
-
-            if start_date > self.get_datetime_with_timezone(tzinfo=start_date.tzinfo):
-                additional = await self.fetch_events(page=page + 1)
-                results.extend(additional)
-            else:
-                def check(result):
-                    start_date = datetime.datetime.fromisoformat(result['start_date'])
-                    return start_date > self.get_datetime_with_timezone(tzinfo=start_date.tzinfo)
-
-                results = [r for r in results if check(r)]
-
-        return results
+    def _is_upcoming(self, result) -> bool:
+        start_date = datetime.datetime.fromisoformat(result['start_date'])
+        if self.cached_tzinfo is None:
+            self.cached_tzinfo = start_date.tzinfo
+
+        return start_date > self.get_datetime_with_timezone(tzinfo=start_date.tzinfo)
+
+    async def _fetch_events_page(self, page: int, page_size: int) -> dict:
+        params = {
+            'format': 'json',
+            'page': page,
+            'page_size': page_size,
+            'ordering': '-event_start'
+        }
+
+        for attempt in range(1, self.fetch_retries + 1):
+            try:
+                # Only held for the request, so a failing page doesn't keep
+                # its slot while it backs off.
+                async with self.fetch_semaphore:
+                    return await self.bot.http_cache.get_json(EVENTS_URL, params=params)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == self.fetch_retries:
+                    raise
+
+                logger.warning(f'Failed to fetch events page {page} (attempt {attempt}), retrying.')
+                await asyncio.sleep(2 ** attempt)
+
+    async def _fetch_events_page_safe(self, page: int, page_size: int) -> list:
+        try:
+            data = await self._fetch_events_page(page, page_size)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            logger.exception(f'Giving up on events page {page}.')
+            return []
+
+        return data['results']
+
+    async def fetch_events(self, page_size: int = 80) -> list:
+        """Fetches all upcoming events ordered by ``-event_start``.
+
+        The first page tells us the total amount of events. The remaining
+        pages are then requested concurrently in waves of at most
+        ``fetch_concurrency`` pages, stopping at the first wave that reaches
+        events that have already started.
+        """
+        data = await self._fetch_events_page(1, page_size)
+        page_count = math.ceil(data['count'] / page_size)
+
+        # The page data is shared with the validator cache, so copy before extending.
+        results = list(data['results'])
+        next_page = 2
+        while results and self._is_upcoming(results[-1]) and next_page <= page_count:
+            last_page = min(next_page + self.fetch_concurrency, page_count + 1)
+            pages = await asyncio.gather(*[
+                self._fetch_events_page_safe(page, page_size)
+                for page in range(next_page, last_page)
+            ])
+            for page_results in pages:
+                results.extend(page_results)
+
+            next_page = last_page
+
+        return [r for r in results if self._is_upcoming(r)]
+
+    @commands.is_owner()
+    @commands.hybrid_command(name='notifierstats')
+    async def notifier_stats(self, ctx):
+        stats = self.dispatcher.stats
+        http_stats = self.bot.http_cache.stats
+        await ctx.send_formatted(
+            f'**Queued notifications:** {stats["depth"]} ({stats["destinations"]} destinations)\n'
+            f'**Sent:** {stats["sent"]} | **Failed:** {stats["failed"]}\n'
+            f'**Send latency:** {stats["average_latency"]:.2f}s avg, {stats["max_latency"]:.2f}s max\n'
+            f'**API cache:** {http_stats["hits"]} hits, {http_stats["misses"]} misses\n'
+            f'**Subscribers:** {len(self.subscriptions)} | **Reminders loaded:** {len(self.reminder_scheduler)}',
+            title='Notifier',
+        )
 
     @commands.hybrid_command()
     async def test(self, ctx):
@@ -0,0 +1,167 @@
+import sys
+import time
+
+from collections import OrderedDict
+
+
+def approximate_size(obj, _depth=0):
+    """Returns a rough amount of bytes used by ``obj`` and the containers
+    and strings it holds. Other objects, like discord models, are shared
+    with the rest of the bot and only counted shallowly."""
+    size = sys.getsizeof(obj)
+    if _depth > 3:
+        return size
+
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += approximate_size(key, _depth + 1) + approximate_size(value, _depth + 1)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for value in obj:
+            size += approximate_size(value, _depth + 1)
+
+    return size
+
+
+class _CacheEntry:
+    __slots__ = ('value', 'size', 'expires_at')
+
+    def __init__(self, value, size, expires_at):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+
+
+class LRUCache:
+    """A mapping based cache with least recently used eviction.
+
+    Parameters
+    ----------
+    max_entries: Optional[:class:`int`]
+        The maximum amount of entries kept. ``None`` means no limit.
+    max_bytes: Optional[:class:`int`]
+        The maximum approximate amount of bytes kept. ``None`` means no limit.
+    ttl: Optional[:class:`float`]
+        How many seconds an entry is kept after it was stored. ``None``
+        means entries never expire.
+    on_evict: Optional[Callable[[Any], None]]
+        Called with the key of every entry evicted or expired by the cache
+        itself. Not called for :meth:`pop` and :meth:`clear`.
+    """
+
+    def __init__(self, *, max_entries=None, max_bytes=None, ttl=None, on_evict=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.on_evict = on_evict
+
+        self._entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and (entry.expires_at is None or entry.expires_at > time.monotonic())
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    @property
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+    def get(self, key, default=None):
+        """Looks up ``key``, counting a hit or a miss."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        if entry.expires_at is not None and entry.expires_at <= time.monotonic():
+            self._expire(key)
+            self.misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def peek(self, key, default=None):
+        """Looks up ``key`` without counting it or marking it as used."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+
+        if entry.expires_at is not None and entry.expires_at <= time.monotonic():
+            self._expire(key)
+            return default
+
+        return entry.value
+
+    def set(self, key, value):
+        self._remove(key)
+
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        entry = _CacheEntry(value, approximate_size(value), expires_at)
+        self._entries[key] = entry
+        self.bytes += entry.size
+
+        self._evict()
+
+    def resize(self, key):
+        """Measures the size of an entry again after its value was changed
+        in place."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+
+        size = approximate_size(entry.value)
+        self.bytes += size - entry.size
+        entry.size = size
+
+        self._evict()
+
+    def pop(self, key, default=None):
+        entry = self._remove(key)
+        return default if entry is None else entry.value
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.size
+        return entry
+
+    def _expire(self, key):
+        self._remove(key)
+        self.expirations += 1
+        if self.on_evict is not None:
+            self.on_evict(key)
+
+    def _evict(self):
+        while self._entries and (
+            (self.max_entries is not None and len(self._entries) > self.max_entries)
+            or (self.max_bytes is not None and self.bytes > self.max_bytes)
+        ):
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(key)
@@ -2,11 +2,22 @@ import asyncpg
 import json
 import discord
 import asyncio
+import logging
+import uuid
 
 from enum import Enum
 from discord.ext import commands
 from typing import Any, List, Tuple
 from . import db, paginator, utils
+from .cache import LRUCache, approximate_size
+from .migrations import Column, TableSchema, sql_literal
+
+logger = logging.getLogger(__name__)
+
+# The channel config changes are published on and the id of this process,
+# used to ignore our own notifications.
+INVALIDATION_CHANNEL = 'config_invalidate'
+PROCESS_ID = uuid.uuid4().hex
 
 
 class ConfigError(Exception):
@@ -72,7 +83,8 @@ class ConfigField:
         safely fetched. Set this to true if the value could in theory become
         invalid after start. That could be someone deleting the channel, role or
         whatever is stored in the field. Defaults to ``True``. (Only useful if
-        Config.use_cache is True)
+        Config.use_cache is True) Fields with ``RELOAD_ON`` set only reload
+        after one of those kinds of guild state changed.
     validate: Optional[Callable[[Any], :class:`bool`]]
         A callable which is used for custom validation of the field. If None
         is passed, then it defaults to the fields regular validation.
@@ -87,7 +99,12 @@ class ConfigField:
     """
 
     SQL_TYPE = None
+    # Converts a column of another type to SQL_TYPE, formatted with the key.
+    SQL_USING = None
     ANY_CONFIG_REQUIREMENT = []
+    # The kinds of guild state, see GuildStateVersions, a loaded value
+    # depends on. Empty means always_reload reloads on every access.
+    RELOAD_ON = ()
 
     def __init__(self, key, name, *,
                  default_value=NullValue(),
@@ -141,13 +158,11 @@ class ConfigField:
 
     def _path_builder_walker(self, list_: list):
         for dep in self.dependencies:
+            path = list_ + [dep]
             if dep.dependencies:
-                l_copy = list_.copy()
-                l_copy.append(dep)
-                yield from dep._path_builder_walker(l=l_copy)
+                yield from dep._path_builder_walker(path)
             else:
-                list_.append(dep)
-                yield list_
+                yield path
 
     def is_active(self, data):
         for dep in self.walk_dependencies():
@@ -162,7 +177,7 @@ class ConfigField:
         return True
 
     def walk_dependency_paths(self):
-        for path in self._path_builder_walker(l=[self]):
+        for path in self._path_builder_walker([self]):
             yield path
 
     async def do_parse(self, guild, inp):
@@ -215,7 +230,14 @@ class ConfigField:
         color = self.color
 
         fmt = ''
-        is_active = self.is_active(paginator.data)
+        graph = paginator.cfg.dependency_graph
+        if graph is not None and self in graph:
+            active, _ = graph.evaluate(paginator.data)
+            is_active = active[self]
+            dependency_paths = graph.paths[self]
+        else:
+            is_active = self.is_active(paginator.data)
+            dependency_paths = list(self.walk_dependency_paths())
 
         if self.description is not None:
             fmt += self.description + '\n\n'
@@ -236,9 +258,7 @@ class ConfigField:
                 fmt += f':warning: This field must be edited :warning:\n\n' \
                        f'Currently set:\n{text}'
 
-                color = utils.get_color(
-                    paginator.bot.config.get('colors', 'error')
-                )
+                color = paginator.bot.error_color
             else:
                 not_active_invalid = True
                 fmt += f'Currently set:\n{text}'
@@ -257,7 +277,7 @@ class ConfigField:
 
             paths = ','.join(
                 f"`{'/'.join(f.name for f in reversed(path[1:]))}`"
-                for path in self.walk_dependency_paths()
+                for path in dependency_paths
             )
             fmt += f'_Depends on {paths}_'
 
@@ -334,7 +354,8 @@ class StringField(ConfigField):
 
 
 class StringsField(ConfigField):
-    SQL_TYPE = 'JSON'
+    SQL_TYPE = 'JSONB'
+    SQL_USING = '{}::text::jsonb'
     DEFAULT_VALUE = []
 
     def __init__(self, *args, min_strings=0, max_strings=5, min_size=1, max_size=100, **kwargs):
@@ -346,10 +367,12 @@ class StringsField(ConfigField):
         self.max_size = max_size
 
     def dump(self, value):
-        return json.dumps(value)
+        return list(value)
 
     def load(self, guild, value):
-        return json.loads(value)
+        if isinstance(value, str):
+            value = db.json_loads(value)
+        return value
 
     def get_formatted(self, value):
         values = '\n'.join(f'`{v}`' for v in (s.replace("`", "\`") for s in value))  # noqa: W605
@@ -392,6 +415,38 @@ class StringsField(ConfigField):
         return result
 
 
+class IntsField(StringsField):
+    """A list of integers, like ids, entered one per line."""
+
+    def load(self, guild, value):
+        value = super().load(guild, value)
+        try:
+            return [int(v) for v in value]
+        except (TypeError, ValueError):
+            return InvalidValue(value)
+
+    def get_formatted(self, value):
+        values = '\n'.join(f'`{v}`' for v in value)
+        if not values:
+            values = 'None set'
+
+        return values
+
+    def get_formatted_edit(self):
+        return 'Please enter the numbers to set. Split each number with a new line.\n\n' \
+               'Example:```\n1\n23\n456```\nEnter `clear`/`none` to clear the inputs.'
+
+    async def parse(self, guild, inp):
+        result = []
+        for line in await super().parse(guild, inp):
+            try:
+                result.append(int(line.strip()))
+            except ValueError:
+                raise ParseError(f'`{line}` is not a number.')
+
+        return result
+
+
 class IntField(ConfigField):
     SQL_TYPE = 'INTEGER'
 
@@ -472,6 +527,7 @@ class RawContentField(ConfigField):
 class ChannelField(ConfigField):
     SQL_TYPE = 'BIGINT'
     ANY_CONFIG_REQUIREMENT = ['GuildConfig']
+    RELOAD_ON = ('channels',)
 
     def dump(self, channel):
         if not channel:
@@ -479,6 +535,9 @@ class ChannelField(ConfigField):
         return channel.id
 
     def load(self, guild, value):
+        if value is None:
+            return None
+
         channel = guild.get_channel(value)
         if channel is None:
             return InvalidValue(value)
@@ -502,6 +561,7 @@ class ChannelField(ConfigField):
 class RoleField(ConfigField):
     SQL_TYPE = 'BIGINT'
     ANY_CONFIG_REQUIREMENT = ['GuildConfig']
+    RELOAD_ON = ('roles',)
 
     def dump(self, role):
         if not role:
@@ -530,9 +590,11 @@ class RoleField(ConfigField):
 
 
 class RolesField(ConfigField):
-    SQL_TYPE = 'JSON'
+    SQL_TYPE = 'JSONB'
+    SQL_USING = '{}::text::jsonb'
     DEFAULT_VALUE = []
     ANY_CONFIG_REQUIREMENT = ['GuildConfig']
+    RELOAD_ON = ('roles',)
 
     def __init__(self, *args, min_size=0, max_size=10, **kwargs):
         super().__init__(*args, **kwargs)
@@ -541,10 +603,13 @@ class RolesField(ConfigField):
         self.max_size = max_size
 
     def dump(self, roles):
-        return json.dumps([r.id for r in roles])
+        return [r.id for r in roles]
 
     def load(self, guild, value):
-        roles = [guild.get_role(v) for v in json.loads(value)]
+        if isinstance(value, str):
+            value = db.json_loads(value)
+
+        roles = [guild.get_role(v) for v in value]
         if None in roles:
             return InvalidValue(value)
 
@@ -619,6 +684,143 @@ class EnumField(ConfigField):
             raise ParseError(f'{inp} is not valid.')
 
 
+class ConfigRecord:
+    """Base of the record classes :meth:`BaseConfig.setup` generates from
+    the fields of a config.
+
+    Every field, and ``identifier``, is a slot readable as an attribute.
+    Records also act as a mapping of field key to value so ``data[key]``
+    keeps working.
+    """
+
+    __slots__ = ()
+    _keys = frozenset()
+
+    @classmethod
+    def create_class(cls, name, keys):
+        keys = ('identifier',) + tuple(k for k in keys if k != 'identifier')
+        return type(name, (cls,), {'__slots__': keys, '_keys': frozenset(keys)})
+
+    def __getitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key not in self._keys:
+            raise KeyError(key)
+
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self._keys and hasattr(self, key)
+
+    def __iter__(self):
+        return (k for k in self.__slots__ if hasattr(self, k))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + sum(approximate_size(self[k]) for k in self)
+
+    def __repr__(self):
+        values = ' '.join(f'{k}={self[k]!r}' for k in self)
+        return f'<{self.__class__.__name__} {values}>'
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[k] for k in self]
+
+    def items(self):
+        return [(k, self[k]) for k in self]
+
+
+class DependencyGraph:
+    """The dependencies between the fields of a config, compiled once.
+
+    Fields are ordered so every field comes after its dependencies, and the
+    dependency paths of every field shown on its page are built up front.
+
+    Parameters
+    ----------
+    fields: Iterable[:class:`ConfigField`]
+        The fields of the config. Dependencies outside of it are included.
+    """
+
+    def __init__(self, fields):
+        self.order = []
+        self.paths = {}
+
+        seen = set()
+        for field in fields:
+            self._visit(field, seen)
+
+        # Only the fields something depends on need to be validated to
+        # tell which fields are active.
+        self.required = {dep for field in self.order for dep in field.dependencies}
+
+    def __contains__(self, field):
+        return field in self.paths
+
+    def _visit(self, field, seen):
+        if field in seen:
+            return
+
+        seen.add(field)
+        for dep in field.dependencies:
+            self._visit(dep, seen)
+
+        paths = []
+        for dep in field.dependencies:
+            if dep.dependencies:
+                paths.extend((field,) + path for path in self.paths[dep])
+            else:
+                paths.append((field, dep))
+
+        self.paths[field] = tuple(paths)
+        self.order.append(field)
+
+    def evaluate(self, data):
+        """Works out which fields are active for ``data`` in one pass.
+
+        Returns
+        -------
+        Tuple[Dict[:class:`ConfigField`, :class:`bool`], Dict[:class:`ConfigField`, :class:`bool`]]
+            Whether each field is active, and the validation result of
+            every field another field depends on.
+        """
+        active = {}
+        valid = {}
+        for field in self.order:
+            is_active = True
+            for dep in field.dependencies:
+                if not (valid[dep] and active[dep]):
+                    is_active = False
+                    break
+
+            active[field] = is_active
+            if field in self.required:
+                try:
+                    valid[field] = field.validate(data[field.key])
+                except KeyError:
+                    valid[field] = False
+
+        return active, valid
+
+
 class PaginatedConfigEditor(paginator.EmbedPaginator):
     EDIT_EMOJI = '\U00002699'
 
@@ -716,15 +918,40 @@ class PaginatedConfigEditor(paginator.EmbedPaginator):
 class BaseConfig:
     HAS_LOADED = False
 
-    def __init__(self, bot, key, use_cache=True):
+    # The options passed to LRUCache when no cache is given.
+    DEFAULT_CACHE_OPTIONS = {}
+
+    # Bind parameters postgres accepts in a single statement.
+    MAX_QUERY_ARGS = 32767
+
+    def __init__(self, bot, key, use_cache=True, cache=None, write_behind=None):
+        """``write_behind`` is the amount of seconds updates are held back
+        before being written in one batch, see :meth:`flush`. ``None`` writes
+        every update immediately."""
         self.bot = bot
         self.key = key  # Never let key be userinput!!
         # self.table_name = f'config_{key}'
         self.use_cache = use_cache
+        self.write_behind = write_behind
 
         self.fields = {}
-        self._cache = {}
+        self._cache = cache if cache is not None else LRUCache(**self.DEFAULT_CACHE_OPTIONS)
+        self._cache.on_evict = self._on_cache_evict
         self._editors = {}
+        self._update_listeners = []
+        self._evict_listeners = []
+        self._reload_versions = {}  # identifier -> {key: guild state version}
+        self._inflight = {}
+        self._queries = {}
+        self._update_queries = {}
+        self._record_class = None
+        self.dependency_graph = None
+        self._dirty = {}  # identifier -> {key: dumped value}
+        self._flushing = {}
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+
+        self.coalesced = 0
 
         self._setup_lock = utils.LockEvent()
         self._is_setup = False
@@ -733,6 +960,14 @@ class BaseConfig:
     def table_name(self):
         raise NotImplementedError
 
+    @property
+    def stats(self):
+        return {
+            'coalesced': self.coalesced,
+            'dirty': len(self._dirty),
+            'cache': self._cache.stats,
+        }
+
     def get_identifier_from_ctx(self, ctx):
         raise NotImplementedError
 
@@ -749,7 +984,13 @@ class BaseConfig:
             if not self.fields:
                 raise RuntimeError('At least one field must be added to the config.')
 
-            await self._create_table_and_validate()
+            await self.bot.migrations.migrate(self.get_schema())
+            self._build_queries()
+            self.dependency_graph = DependencyGraph(self.fields.values())
+            self._record_class = ConfigRecord.create_class(
+                f'{self.__class__.__name__}Record_{self.key}',
+                self.fields,
+            )
             self._is_setup = True
 
     def setup(self):
@@ -763,9 +1004,14 @@ class BaseConfig:
         if not field.validate_setup():
             raise RuntimeError(f'Field {field.key} was not properly set up.')
 
+        if field.key == 'identifier' or hasattr(ConfigRecord, field.key):
+            raise RuntimeError(f'{field.key} is a reserved name and cannot be used as a key.')
+
         field._inject_bot(self.bot)
 
         self.fields[field.key] = field
+        if self.dependency_graph is not None:
+            self.dependency_graph = DependencyGraph(self.fields.values())
         return field
 
     def remove_field(self, field):
@@ -773,6 +1019,9 @@ class BaseConfig:
             del self.fields[field.key]
         except KeyError:
             pass
+        else:
+            if self.dependency_graph is not None:
+                self.dependency_graph = DependencyGraph(self.fields.values())
 
     def get_field(self, key):
         return self.fields.get(key)
@@ -780,8 +1029,56 @@ class BaseConfig:
     def get_config(self, identifier):
         return self._cache.get(identifier)
 
+    def add_update_listener(self, coro):
+        """Registers a coroutine function which is called with the identifier
+        and the updated keys whenever fields are updated through
+        :meth:`dump_and_update_config_fields`."""
+        if not asyncio.iscoroutinefunction(coro):
+            raise TypeError('coro must be a coroutine.')
+
+        self._update_listeners.append(coro)
+
+    def remove_update_listener(self, coro):
+        self._update_listeners = [c for c in self._update_listeners if c != coro]
+
+    def dispatch_update(self, identifier, keys):
+        for coro in self._update_listeners:
+            utils.create_tracebacked_task(coro(identifier, keys))
+
+    def add_evict_listener(self, func):
+        """Registers a function which is called with the identifier whenever
+        a config is evicted from the cache, or with ``None`` when the whole
+        cache is cleared. Used to drop values derived from cached configs."""
+        self._evict_listeners.append(func)
+
+    def remove_evict_listener(self, func):
+        self._evict_listeners = [f for f in self._evict_listeners if f != func]
+
     def _store_config(self, identifier, data):
-        self._cache[identifier] = data
+        self._cache.set(identifier, data)
+        self._reload_versions.pop(identifier, None)
+
+    def _on_cache_evict(self, identifier):
+        self._reload_versions.pop(identifier, None)
+        for func in self._evict_listeners:
+            func(identifier)
+
+    def peek_config(self, identifier):
+        """Returns the cached config data of ``identifier``, or ``None`` if it
+        isn't cached. Never fetches and doesn't count as a cache lookup."""
+        if not self.use_cache:
+            return None
+        return self._cache.peek(identifier)
+
+    def evict_config(self, identifier):
+        self._cache.pop(identifier)
+        self._on_cache_evict(identifier)
+
+    def clear_cache(self):
+        self._cache.clear()
+        self._reload_versions.clear()
+        for func in self._evict_listeners:
+            func(None)
 
     def add_editor(self, identifier, editor):
         if identifier in self._editors:
@@ -805,12 +1102,24 @@ class BaseConfig:
         if reload:
             self.reload_data(identifier, data)
 
+        return not self.get_invalid_fields(data)
+
+    def get_invalid_fields(self, data):
+        """Returns the keys of the active fields whose value in ``data`` is
+        invalid."""
+        active, valid = self.dependency_graph.evaluate(data)
+
+        invalid = []
         for field in self.fields.values():
-            if field.is_active(data):
-                if not field.validate(data[field.key]):
-                    return False
+            if active[field]:
+                is_valid = valid.get(field)
+                if is_valid is None:
+                    is_valid = field.validate(data[field.key])
 
-        return True
+                if not is_valid:
+                    invalid.append(field.key)
+
+        return invalid
 
     async def run_paginator(self, ctx):
         await self._setup_lock.wait()
@@ -835,68 +1144,101 @@ class BaseConfig:
         self.add_editor(identifier, paginator)
         await paginator.run_and_await()
 
-    def reload_data(self, identifier, data):
-        for field in self.fields.values():
-            value = data[field.key]
-            if self.use_cache and field.always_reload and not isinstance(value, InvalidValue):
-                new_value = self._load_field(identifier, field, field.dump(value))
-                data[field.key] = new_value
+    def _reload_field(self, identifier, field, data):
+        """Returns the value of an ``always_reload`` field in ``data``, loading
+        it again only if the guild state it depends on changed since the
+        last time it was loaded."""
+        value = data[field.key]
+        if isinstance(value, InvalidValue):
+            return value
 
-        return data
+        versions = self._reload_versions.get(identifier)
+        if versions is None:
+            versions = self._reload_versions[identifier] = {}
 
-    async def _create_table(self, con=None):
-        async with db.MaybeAcquire(con, self.bot.pool) as con:
-            parts = (f'{f.key} {f.SQL_TYPE}' for f in self.fields.values())
-            query = f'CREATE TABLE {self.table_name} (identifier BIGINT, {", ".join(parts)});'
-            try:
-                await con.execute(query)
-            except asyncpg.DuplicateTableError:
-                return False
-            return True
+        version = None
+        if field.RELOAD_ON:
+            version = self.bot.guild_state.get(identifier, field.RELOAD_ON)
+            if versions.get(field.key) == version:
+                return value
 
-    async def _validate_field(self, field, con=None):
-        async with db.MaybeAcquire(con, self.bot.pool) as con:
-            query = f'SELECT {field.key} FROM {self.table_name} WHERE 1 = 0;'
-            try:
-                await con.fetch(query)
-            except asyncpg.UndefinedColumnError:
-                return field
+        value = data[field.key] = self._load_field(identifier, field, field.dump(value))
+        if version is not None:
+            versions[field.key] = version
 
-    async def _create_table_and_validate(self, con=None):
-        async with db.MaybeAcquire(con, self.bot.pool) as con:
-            res = await self._create_table(con=con)
-            if res is True:
-                return
+        self._cache.resize(identifier)
 
-        values = await asyncio.gather(
-            *[self.bot.loop.create_task(self._validate_field(f))
-                for f in self.fields.values()]
-        )
+        return value
 
-        async with self.bot.pool.acquire() as con:
-            fields = [f for f in values if f is not None]
-            if fields:
-                parts = ', '.join(f'{f.key} {f.SQL_TYPE}' for f in fields)
-                query = f'ALTER TABLE {self.table_name} ADD {parts};'
-                await con.execute(query)
-
-                clauses = ', '.join(f'{f.key} = ${i}' for i, f in enumerate(fields, 1))
-                query = f'UPDATE {self.table_name} SET {clauses};'
-                await con.execute(
-                    query,
-                    *[f.dump(f.default_value) for f in fields]
-                )
+    def reload_data(self, identifier, data):
+        if not self.use_cache:
+            return data
 
-    def _load_data(self, identifier, data):
-        data = dict(data)
         for field in self.fields.values():
-            if field.key not in data:
-                data[field.key] = self._load_field(identifier, field, field.dump(field.default_value))
-            else:
-                data[field.key] = self._load_field(identifier, field, data[field.key])
+            if field.always_reload:
+                self._reload_field(identifier, field, data)
 
         return data
 
+    def get_schema(self):
+        """Returns the :class:`TableSchema` of the config table. Every field
+        column defaults to the dumped default value of the field."""
+        columns = [Column('identifier', 'BIGINT')]
+        for field in self.fields.values():
+            default = self._dump_field(field, field.default_value)
+            using = field.SQL_USING.format(field.key) if field.SQL_USING is not None else None
+            columns.append(Column(field.key, field.SQL_TYPE, default=sql_literal(default), using=using))
+
+        return TableSchema(self.table_name, columns, primary_key=('identifier',))
+
+    def _build_queries(self):
+        """Builds the SQL of the statements used on every lookup once. asyncpg
+        prepares each of them once per connection through its statement cache."""
+        keys = ', '.join(self.fields)
+        placeholders = ', '.join(f'${i}' for i in range(2, len(self.fields) + 2))
+        self._queries = {
+            'fetch': f'SELECT * FROM {self.table_name} WHERE identifier = $1;',
+            'fetch_many': f'SELECT * FROM {self.table_name} WHERE identifier = ANY($1::BIGINT[]);',
+            'create': (f'INSERT INTO {self.table_name} (identifier, {keys}) VALUES ($1, {placeholders}) '
+                       f'ON CONFLICT (identifier) DO NOTHING RETURNING *;'),
+            'create_many': (f'INSERT INTO {self.table_name} (identifier, {keys}) '
+                            f'SELECT identifier, {placeholders} FROM unnest($1::BIGINT[]) AS identifier '
+                            f'ON CONFLICT (identifier) DO NOTHING RETURNING *;'),
+        }
+        self._update_queries = {}
+
+    def _get_update_query(self, keys):
+        keys = tuple(keys)
+        query = self._update_queries.get(keys)
+        if query is None:
+            clauses = ', '.join(f'{k} = ${i}' for i, k in enumerate(keys, 3))
+            query = self._update_queries[keys] = (
+                f'WITH updated AS ('
+                f'UPDATE {self.table_name} SET {clauses} WHERE identifier = $1 RETURNING identifier'
+                f') SELECT pg_notify(\'{INVALIDATION_CHANNEL}\', $2) FROM updated;'
+            )
+
+        return query
+
+    def _load_data(self, identifier, data):
+        record = self._record_class()
+        record.identifier = identifier
+        for field in self.fields.values():
+            try:
+                value = data[field.key]
+            except KeyError:
+                value = field.dump(field.default_value)
+
+            setattr(record, field.key, self._load_field(identifier, field, value))
+
+        return record
+
+    def load_row(self, row):
+        """Loads a row of the config table fetched by the caller, with the
+        updates not yet written by :meth:`flush` applied. The result is not
+        cached."""
+        return self._load_data(row['identifier'], self._apply_pending(row))
+
     def _dump_field(self, field, value):
         try:
             res = field.dump(value)
@@ -908,18 +1250,57 @@ class BaseConfig:
             return None
 
     async def create_row(self, identifier, con=None):
-        dumped = {k: f.dump(f.default_value) for k, f in self.fields.items()}
-        keys = ', '.join(dumped.keys())
-        placeholders = ', '.join(f'${i}' for i in range(1, len(dumped) + 2))
+        dumped = [f.dump(f.default_value) for f in self.fields.values()]
         async with db.MaybeAcquire(con, self.bot.pool) as con:
-            query = f'INSERT INTO {self.table_name} (identifier, {keys}) VALUES ({placeholders});'
-            await con.execute(
-                query,
-                identifier,
-                *list(dumped.values())
-            )
+            res = await con.fetchrow(self._queries['create'], identifier, *dumped)
+
+            # Someone else created the row between our select and insert.
+            if res is None:
+                res = await con.fetchrow(self._queries['fetch'], identifier)
+
+        return res
+
+    async def create_rows(self, identifiers, con=None):
+        """Creates default rows for all identifiers with a single statement."""
+        dumped = [f.dump(f.default_value) for f in self.fields.values()]
+        async with db.MaybeAcquire(con, self.bot.pool) as con:
+            return await con.fetch(self._queries['create_many'], identifiers, *dumped)
+
+    async def prewarm(self, identifiers, con=None):
+        """Loads the configs of all identifiers not already cached in one
+        query, creating the missing rows. Returns the amount loaded."""
+        if not self.use_cache:
+            return 0
+
+        await self._setup_lock.wait()
+        if not self._is_setup:
+            raise RuntimeError('Config is not setup yet by setup().')
+
+        identifiers = [i for i in set(identifiers) if i not in self._cache]
+        if not identifiers:
+            return 0
+
+        async with db.MaybeAcquire(con, self.bot.pool) as con:
+            rows = await con.fetch(self._queries['fetch_many'], identifiers)
+
+            found = {r['identifier'] for r in rows}
+            missing = [i for i in identifiers if i not in found]
+            if missing:
+                rows.extend(await self.create_rows(missing, con=con))
+
+        rows = [self._apply_pending(r) for r in rows]
+
+        loaded = 0
+        for row in rows:
+            try:
+                data = self._load_data(row['identifier'], row)
+            except ConfigError:
+                continue
+
+            self._store_config(row['identifier'], data)
+            loaded += 1
 
-        return dumped
+        return loaded
 
     async def fetch_config(self, identifier, create_if_not_exists=True, con=None):
         await self._setup_lock.wait()
@@ -927,49 +1308,82 @@ class BaseConfig:
             raise RuntimeError('Config is not setup yet by setup().')
 
         async with db.MaybeAcquire(con, self.bot.pool) as con:
-            query = f'SELECT * FROM {self.table_name} WHERE identifier = $1;'
-            res = await con.fetchrow(query, identifier)
+            res = await con.fetchrow(self._queries['fetch'], identifier)
             if res is None and create_if_not_exists:
                 res = await self.create_row(identifier, con=con)
             elif res is None:
                 return None
 
-            return res
+            return self._apply_pending(res)
 
-    async def fetch_and_load_config(self, identifier, cache=True, create_if_not_exists=True, con=None):
-        if cache:
-            data = self.get_config(identifier)
-            if data is not None:
-                return data
+    async def fetch_all_configs(self, keys, con=None):
+        """Returns the identifier and the raw stored values of ``keys`` for
+        every row in the table."""
+        await self._setup_lock.wait()
+        if not self._is_setup:
+            raise RuntimeError('Config is not setup yet by setup().')
 
-        res = await self.fetch_config(
-            identifier,
-            create_if_not_exists=create_if_not_exists,
-            con=con,
-        )
-        if res is None:
-            return None
+        async with db.MaybeAcquire(con, self.bot.pool) as con:
+            query = f'SELECT identifier, {", ".join(keys)} FROM {self.table_name};'
+            rows = await con.fetch(query)
 
-        data = self._load_data(identifier, res)
-        if self.use_cache:
-            self._store_config(identifier, data)
+        if not self._dirty and not self._flushing:
+            return rows
 
-        return data
+        keys = set(keys)
+        return [self._apply_pending(r, keys) for r in rows]
 
-    async def fetch_and_load_config_field(self, identifier, key, cache=True, con=None):
-        data = None
+    async def fetch_and_load_config(self, identifier, cache=True, create_if_not_exists=True, con=None):
         if cache:
             data = self.get_config(identifier)
+            if data is not None:
+                return data
 
-        if data is None:
-            data = await self.fetch_and_load_config(
+        # Concurrent misses for the same identifier share a single fetch.
+        future = self._inflight.get(identifier)
+        if future is not None:
+            self.coalesced += 1
+            try:
+                data = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+            else:
+                if data is not None or not create_if_not_exists:
+                    return data
+
+        future = self._inflight[identifier] = self.bot.loop.create_future()
+        try:
+            res = await self.fetch_config(
                 identifier,
-                cache=cache,
+                create_if_not_exists=create_if_not_exists,
                 con=con,
             )
+            if res is None:
+                data = None
+            else:
+                data = self._load_data(identifier, res)
+                if self.use_cache:
+                    self._store_config(identifier, data)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Only waiters should see the exception, it is raised here anyway.
+            future.exception()
+            raise
+        else:
+            future.set_result(data)
+            return data
+        finally:
+            if self._inflight.get(identifier) is future:
+                del self._inflight[identifier]
 
-            if data is None:
-                return None
+    async def fetch_and_load_config_field(self, identifier, key, cache=True, con=None):
+        data = await self.fetch_and_load_config(identifier, cache=cache, con=con)
+        if data is None:
+            return None
 
         return data.get(key)
 
@@ -989,25 +1403,132 @@ class BaseConfig:
             raise RuntimeError('Config is not setup yet by setup()')
 
         key_iter, value_iter = self._get_iters(data)
+        keys = list(key_iter())
+        values = list(value_iter())
+
+        if self.write_behind is not None:
+            changes = self._dirty.get(identifier)
+            if changes is None:
+                changes = self._dirty[identifier] = {}
+            changes.update(zip(keys, values))
+            self._schedule_flush()
+            return
+
+        # Other processes are told to drop their cached copy in the same statement.
+        payload = json.dumps({
+            'table': self.table_name,
+            'identifier': identifier,
+            'keys': keys,
+            'origin': PROCESS_ID,
+        })
 
-        clauses = ', '.join(f'{k} = ${i}' for i, k in enumerate(key_iter(), 2))
         async with db.MaybeAcquire(con, self.bot.pool) as con:
-            query = f'UPDATE {self.table_name} SET {clauses} WHERE identifier = $1;'
-            await con.execute(
-                query,
-                identifier,
-                *list(value_iter()),
-            )
+            await con.execute(self._get_update_query(keys), identifier, payload, *values)
 
     async def update_config_field(self, identifier, key, value, con=None):
-        await self.update_config_fields(identifier, (key, value), con=con)
+        await self.update_config_fields(identifier, ((key, value),), con=con)
+
+    def _apply_pending(self, row, keys=None):
+        """Returns ``row`` with the changes not yet written by :meth:`flush`
+        applied, so reads see earlier updates."""
+        identifier = row['identifier']
+        flushing = self._flushing.get(identifier)
+        dirty = self._dirty.get(identifier)
+        if flushing is None and dirty is None:
+            return row
+
+        row = dict(row)
+        for changes in (flushing, dirty):
+            if changes is not None:
+                row.update((k, v) for k, v in changes.items() if keys is None or k in keys)
+
+        return row
+
+    def _schedule_flush(self):
+        if self._flush_task is None:
+            self._flush_task = utils.create_tracebacked_task(self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.write_behind)
+        finally:
+            self._flush_task = None
+
+        await self.flush()
+
+    async def flush(self, con=None):
+        """Writes the updates held back in write-behind mode with one
+        ``UPDATE ... FROM (VALUES ...)`` per set of updated keys, and tells
+        other processes about them. Returns the amount of configs written.
+
+        If writing fails the updates are kept and retried later.
+        """
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+
+            self._flushing, self._dirty = self._dirty, {}
+            groups = {}
+            for identifier, changes in self._flushing.items():
+                keys = tuple(sorted(changes))
+                groups.setdefault(keys, []).append((identifier, [changes[k] for k in keys]))
+
+            try:
+                async with db.MaybeAcquire(con, self.bot.pool) as con:
+                    async with con.transaction():
+                        for keys, rows in groups.items():
+                            await self._flush_group(con, keys, rows)
+            except Exception:
+                # Updates made during the flush are newer than the failed ones.
+                for identifier, changes in self._dirty.items():
+                    self._flushing.setdefault(identifier, {}).update(changes)
+                self._dirty = self._flushing
+                self._schedule_flush()
+                raise
+            finally:
+                flushed = len(self._flushing)
+                self._flushing = {}
+
+            return flushed
+
+    async def _flush_group(self, con, keys, rows):
+        types = ['BIGINT'] + [self.fields[k].SQL_TYPE for k in keys]
+        columns = ', '.join(('identifier',) + keys)
+        clauses = ', '.join(f'{k} = v.{k}' for k in keys)
+
+        # Leaves room for the three notification arguments.
+        per_chunk = (self.MAX_QUERY_ARGS - 3) // len(types)
+        for start in range(0, len(rows), per_chunk):
+            chunk = rows[start:start + per_chunk]
+
+            args = []
+            values = []
+            for identifier, row_values in chunk:
+                offset = len(args) + 4
+                values.append('(' + ', '.join(
+                    f'${offset + i}::{t}' for i, t in enumerate(types)
+                ) + ')')
+                args.append(identifier)
+                args.extend(row_values)
+
+            query = (
+                f'WITH updated AS ('
+                f'UPDATE {self.table_name} AS t SET {clauses} '
+                f'FROM (VALUES {", ".join(values)}) AS v ({columns}) '
+                f'WHERE t.identifier = v.identifier RETURNING t.identifier'
+                f') SELECT pg_notify(\'{INVALIDATION_CHANNEL}\', json_build_object('
+                f'\'table\', $1::TEXT, \'identifier\', identifier, '
+                f'\'keys\', $2::JSONB, \'origin\', $3::TEXT)::TEXT) FROM updated;'
+            )
+            await con.fetch(query, self.table_name, list(keys), PROCESS_ID, *args)
 
     async def dump_and_update_config_fields(self, identifier, data: List[Tuple[ConfigField, Any]], con=None):
         if self.use_cache:
-            g_data = self.get_config(identifier)
+            g_data = self._cache.peek(identifier)
             if g_data is not None:
                 for field, value in data:
                     g_data[field.key] = value
+                self._cache.resize(identifier)
 
         key_iter, value_iter = self._get_iters(data)
 
@@ -1015,6 +1536,7 @@ class BaseConfig:
         # times and I dont want dump() to be called each time.
         dumped = [(f.key, self._dump_field(f, v)) for f, v in zip(key_iter(), value_iter())]
         await self.update_config_fields(identifier, dumped, con=con)
+        self.dispatch_update(identifier, [k for k, _ in dumped])
 
     async def dump_and_update_config_field(self, identifier, field, value, con=None):
         await self.dump_and_update_config_fields(identifier, ((field, value),), con=con)
@@ -1024,19 +1546,20 @@ class BaseConfig:
         if field is None:
             raise KeyError(f'No field exists by the key {key}.')
 
-        value = await self.fetch_and_load_config_field(identifier, key, cache=True, con=None)
-        if not self.use_cache or not field.always_reload or isinstance(value, InvalidValue):
-            return value
+        data = await self.fetch_and_load_config(identifier, cache=cache, con=con)
+        if data is None:
+            return None
 
-        new_value = self._load_field(identifier, field, field.dump(value))
-        data = self.get_config(identifier)
-        if data is not None:
-            data[key] = new_value
+        if not self.use_cache or not field.always_reload:
+            return data.get(key)
 
-        return new_value
+        return self._reload_field(identifier, field, data)
 
 
 class GuildConfig(BaseConfig):
+    # Bots are in comparatively few guilds, so keep all of them.
+    DEFAULT_CACHE_OPTIONS = {}
+
     @property
     def table_name(self):
         return f'config_guild_{self.key}'
@@ -1055,6 +1578,8 @@ class GuildConfig(BaseConfig):
 
 
 class UserConfig(BaseConfig):
+    DEFAULT_CACHE_OPTIONS = {'max_entries': 10_000, 'ttl': 60 * 60}
+
     @property
     def table_name(self):
         return f'config_user_{self.key}'
@@ -1067,6 +1592,25 @@ class UserConfig(BaseConfig):
         return field.load(None, data)
 
 
+class GuildStateVersions:
+    """Counts changes to the state of each guild by kind, e.g. ``'roles'``
+    or ``'channels'``, so values resolved against a guild can be reused
+    until the state they were resolved from changes."""
+
+    def __init__(self):
+        self._versions = {}  # (guild id, kind) -> version
+
+    def get(self, guild_id, kinds):
+        versions = self._versions
+        if len(kinds) == 1:
+            return versions.get((guild_id, kinds[0]), 0)
+        return sum(versions.get((guild_id, k), 0) for k in kinds)
+
+    def bump(self, guild_id, kind):
+        key = (guild_id, kind)
+        self._versions[key] = self._versions.get(key, 0) + 1
+
+
 class ConfigManager:
     def __init__(self, bot):
         self.bot = bot
@@ -1100,3 +1644,109 @@ class ConfigManager:
 
     def get_config(self, key):
         return self._configs.get(key)
+
+    @property
+    def configs(self):
+        return list(self._configs.values())
+
+    async def prewarm(self, identifiers):
+        identifiers = list(identifiers)
+        await asyncio.gather(*[c.prewarm(identifiers) for c in self._configs.values()])
+
+    def evict(self, identifier):
+        for config in self._configs.values():
+            config.evict_config(identifier)
+
+    async def flush(self):
+        for config in self._configs.values():
+            try:
+                await config.flush()
+            except Exception:
+                logger.exception(f'Failed to flush config {config.key}.')
+
+    def get_config_by_table(self, table_name):
+        for config in self._configs.values():
+            if config.table_name == table_name:
+                return config
+
+
+class ConfigInvalidationListener:
+    """Keeps the config caches of several processes coherent.
+
+    Every update made through :meth:`BaseConfig.update_config_fields`
+    publishes the table and identifier on :data:`INVALIDATION_CHANNEL`.
+    This listener holds a dedicated connection listening on that channel
+    and evicts, and if it was cached refreshes, the matching entry.
+    """
+
+    def __init__(self, bot, managers, connect_options):
+        self.bot = bot
+        self.managers = managers
+        self.connect_options = connect_options
+
+        self._con = None
+        self._closed = False
+
+    def _get_config(self, table_name):
+        for manager in self.managers:
+            config = manager.get_config_by_table(table_name)
+            if config is not None:
+                return config
+
+    async def start(self):
+        self._closed = False
+        self._con = await asyncpg.connect(**self.connect_options)
+        self._con.add_termination_listener(self._on_termination)
+        await self._con.add_listener(INVALIDATION_CHANNEL, self._on_notification)
+
+    async def close(self):
+        self._closed = True
+        if self._con is not None:
+            await self._con.close()
+            self._con = None
+
+    def _on_termination(self, con):
+        if self._closed:
+            return
+
+        # Notifications might have been missed while disconnected.
+        for manager in self.managers:
+            for config in manager.configs:
+                config.clear_cache()
+
+        utils.create_tracebacked_task(self._reconnect())
+
+    async def _reconnect(self):
+        delay = 1
+        while not self._closed:
+            try:
+                await self.start()
+            except (OSError, asyncpg.PostgresError):
+                logger.warning(f'Could not reconnect config listener, retrying in {delay}s.')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+            else:
+                logger.info('Reconnected config listener.')
+                return
+
+    def _on_notification(self, con, pid, channel, payload):
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            logger.warning(f'Ignoring malformed config notification: {payload}')
+            return
+
+        if data.get('origin') == PROCESS_ID:
+            return
+
+        config = self._get_config(data['table'])
+        if config is None:
+            return
+
+        identifier = data['identifier']
+        was_cached = identifier in config._cache
+        config.evict_config(identifier)
+        if was_cached:
+            utils.create_tracebacked_task(config.fetch_and_load_config(identifier))
+
+        config.dispatch_update(identifier, data.get('keys', []))
@@ -227,7 +227,7 @@ class DiscordContext(d_commands.Context):
         if color is None:
             color = self.bot.color
 
-        embed = discord.Embed(title=title, color=color, description=message)
+        embed = utils.create_embed(message, title=title, color=color, footer=footer)
 
         if header is not None:
             embed.set_author(
@@ -237,9 +237,6 @@ class DiscordContext(d_commands.Context):
                           else None)
             )
 
-        if footer is not None:
-            embed.set_footer(text=footer)
-
         return await self.send(embed=embed, **kwargs)
 
     async def send_success(self, message,
@@ -1,3 +1,33 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    def json_dumps(value):
+        return orjson.dumps(value).decode()
+
+    json_loads = orjson.loads
+else:
+    json_dumps = json.dumps
+    json_loads = json.loads
+
+
+async def init_connection(con):
+    """``init`` hook of the pool. Registers the JSON codecs so json and jsonb
+    columns are read and written as python objects. orjson is used for
+    them if it is installed."""
+    for typename in ('json', 'jsonb'):
+        await con.set_type_codec(
+            typename,
+            encoder=json_dumps,
+            decoder=json_loads,
+            schema='pg_catalog',
+        )
+
+
 class MaybeAcquire:
     def __init__(self, connection, pool):
         self.connection = connection
@@ -0,0 +1,312 @@
+import asyncio
+import discord
+import heapq
+import itertools
+import logging
+import time
+
+from enum import IntEnum
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    URGENT = 0  # Registration openings and other time critical messages.
+    HIGH = 1
+    NORMAL = 2
+    LOW = 3  # Digests and anything else that can wait.
+
+
+class TokenBucket:
+    """A token bucket refilling ``rate`` tokens per second up to ``capacity``.
+
+    The bucket can be paused until a given time, which is used to follow
+    the ``Retry-After``/``X-RateLimit-Reset-After`` headers of a 429.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self):
+        """Returns how long until a token is available, without taking one."""
+        now = time.monotonic()
+        self._refill(now)
+
+        delay = max(0.0, self._paused_until - now)
+        if self._tokens < 1:
+            delay = max(delay, (1 - self._tokens) / self.rate)
+        return delay
+
+    def take(self):
+        self._tokens -= 1
+
+    def is_full(self):
+        return self.delay() == 0 and self._tokens >= self.capacity
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                delay = self.delay()
+                if delay <= 0:
+                    self.take()
+                    return
+
+                await asyncio.sleep(delay)
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def update_from_headers(self, headers):
+        """Pauses the bucket according to the rate limit headers of a response.
+        Returns the amount of seconds paused."""
+        retry_after = headers.get('X-RateLimit-Reset-After') or headers.get('Retry-After')
+        try:
+            seconds = float(retry_after)
+        except (TypeError, ValueError):
+            return 0.0
+
+        self.pause(seconds)
+        return seconds
+
+
+class Notification:
+    __slots__ = ('destination', 'priority', 'kwargs', 'edit', 'callback', 'error_callback', 'enqueued_at')
+
+    def __init__(self, destination, priority, kwargs, *, edit=None, callback=None, error_callback=None):
+        self.destination = destination
+        self.priority = priority
+        self.kwargs = kwargs
+        self.edit = edit
+        self.callback = callback
+        self.error_callback = error_callback
+        self.enqueued_at = time.monotonic()
+
+
+class NotificationDispatcher:
+    """Delivers messages to channels and users from a bounded pool of tasks.
+
+    Every destination has its own queue ordered by priority, and only one
+    message per destination is in flight at a time. Destinations with
+    pending messages wait in a shared queue ordered by the priority of
+    their most urgent message. Sends take a token from a global bucket and
+    from a per-destination bucket modelled after Discord's per channel limit.
+
+    Callers only enqueue, they never wait for delivery. Edits of earlier
+    messages go through the same queues as new messages.
+
+    Destinations are ``('channel', channel_id)`` or ``('user', user_id)``.
+    """
+
+    def __init__(self, bot, *,
+                 workers=4,
+                 global_rate=50,
+                 destination_rate=5 / 5,
+                 destination_burst=5):
+        self.bot = bot
+        self.worker_count = workers
+        self.destination_rate = destination_rate
+        self.destination_burst = destination_burst
+
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self._buckets = {}
+        self._queues = {}
+        self._ready = asyncio.PriorityQueue()
+        self._scheduled = set()
+        self._counter = itertools.count()
+        self._workers = []
+
+        self.depth = 0
+        self.sent = 0
+        self.failed = 0
+        self.average_latency = 0.0
+        self.max_latency = 0.0
+
+    @property
+    def stats(self):
+        return {
+            'depth': self.depth,
+            'destinations': len(self._queues),
+            'sent': self.sent,
+            'failed': self.failed,
+            'average_latency': self.average_latency,
+            'max_latency': self.max_latency,
+        }
+
+    def start(self):
+        if not self._workers:
+            self._workers = [
+                asyncio.create_task(self._worker())
+                for _ in range(self.worker_count)
+            ]
+
+    async def stop(self, timeout=10.0):
+        """Stops the workers once the queued notifications are delivered, or
+        after ``timeout`` seconds. Whatever is still queued then is dropped."""
+        if self._workers and self.depth:
+            try:
+                await asyncio.wait_for(self._wait_drained(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+
+        if self.depth:
+            logger.warning(f'Dropped {self.depth} undelivered notifications '
+                           f'for {len(self._queues)} destinations.')
+
+    async def _wait_drained(self):
+        while self.depth:
+            await asyncio.sleep(0.1)
+
+    def enqueue(self, destination, *,
+                priority=Priority.NORMAL,
+                edit=None,
+                callback=None,
+                error_callback=None,
+                **kwargs):
+        """Queues ``kwargs`` to be passed to ``send()`` of the destination.
+
+        If ``edit`` is a ``(channel_id, message_id)`` tuple, that message is
+        edited instead. It still goes through the queue and rate limits of
+        ``destination``, the destination the message was first sent to.
+
+        ``callback`` is a coroutine function awaited with the sent or edited
+        :class:`discord.Message`. ``error_callback`` is awaited with the
+        :class:`discord.HTTPException` if delivery failed.
+        """
+        notification = Notification(
+            destination,
+            priority,
+            kwargs,
+            edit=edit,
+            callback=callback,
+            error_callback=error_callback,
+        )
+
+        queue = self._queues.get(destination)
+        if queue is None:
+            queue = self._queues[destination] = []
+        heapq.heappush(queue, (priority, next(self._counter), notification))
+
+        self.depth += 1
+        self._schedule(destination)
+
+    def _schedule(self, destination, delay=0):
+        if destination in self._scheduled:
+            return
+
+        queue = self._queues.get(destination)
+        if not queue:
+            self._queues.pop(destination, None)
+
+            bucket = self._buckets.get(destination)
+            if bucket is not None and bucket.is_full():
+                del self._buckets[destination]
+            return
+
+        self._scheduled.add(destination)
+        item = (queue[0][0], next(self._counter), destination)
+        if delay > 0:
+            self.bot.loop.call_later(delay, self._ready.put_nowait, item)
+        else:
+            self._ready.put_nowait(item)
+
+    def _get_bucket(self, destination):
+        bucket = self._buckets.get(destination)
+        if bucket is None:
+            bucket = self._buckets[destination] = TokenBucket(
+                self.destination_rate,
+                self.destination_burst,
+            )
+        return bucket
+
+    async def _get_messageable(self, destination):
+        kind, id_ = destination
+        if kind == 'channel':
+            return self.bot.get_channel(id_) or self.bot.get_partial_messageable(id_)
+
+        user = self.bot.get_user(id_)
+        if user is None:
+            user = await self.bot.fetch_user(id_)
+        return user
+
+    async def _deliver(self, notification):
+        if notification.edit is not None:
+            channel_id, message_id = notification.edit
+            channel = self.bot.get_partial_messageable(channel_id)
+            await self.global_bucket.acquire()
+            return await channel.get_partial_message(message_id).edit(**notification.kwargs)
+
+        messageable = await self._get_messageable(notification.destination)
+        await self.global_bucket.acquire()
+        return await messageable.send(**notification.kwargs)
+
+    def _record_latency(self, notification):
+        latency = time.monotonic() - notification.enqueued_at
+        self.average_latency += (latency - self.average_latency) * 0.1
+        self.max_latency = max(self.max_latency, latency)
+
+    async def _worker(self):
+        while True:
+            _, _, destination = await self._ready.get()
+
+            bucket = self._get_bucket(destination)
+            delay = bucket.delay()
+            if delay > 0:
+                self._scheduled.discard(destination)
+                self._schedule(destination, delay=delay)
+                continue
+
+            queue = self._queues[destination]
+            _, _, notification = heapq.heappop(queue)
+            bucket.take()
+
+            retry_after = 0
+            try:
+                message = await self._deliver(notification)
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    retry_after = max(1.0, bucket.update_from_headers(e.response.headers))
+                    if e.response.headers.get('X-RateLimit-Global'):
+                        self.global_bucket.update_from_headers(e.response.headers)
+
+                    heapq.heappush(queue, (notification.priority, next(self._counter), notification))
+                else:
+                    self.depth -= 1
+                    self.failed += 1
+                    logger.warning(f'Failed to deliver notification to {destination}: {e}')
+
+                    if notification.error_callback is not None:
+                        try:
+                            await notification.error_callback(e)
+                        except Exception:
+                            logger.exception('Notification error callback failed.')
+            except Exception:
+                self.depth -= 1
+                self.failed += 1
+                logger.exception(f'Failed to deliver notification to {destination}.')
+            else:
+                self.depth -= 1
+                self.sent += 1
+                self._record_latency(notification)
+
+                if notification.callback is not None:
+                    try:
+                        await notification.callback(message)
+                    except Exception:
+                        logger.exception('Notification callback failed.')
+
+            self._scheduled.discard(destination)
+            self._schedule(destination, delay=retry_after)
@@ -0,0 +1,239 @@
+import datetime
+import hashlib
+import json
+
+from . import db
+from .migrations import Column, TableSchema
+
+EVENTS_SCHEMA = TableSchema(
+    'ow_events',
+    [
+        Column('id', 'INTEGER'),
+        Column('title', 'TEXT'),
+        Column('description', 'TEXT'),
+        Column('start_date', 'TIMESTAMP'),
+        Column('end_date', 'TIMESTAMP'),
+        Column('organizer', 'INT'),
+        Column('last_updated', 'TIMESTAMP'),
+        Column('registration_start', 'TIMESTAMP'),
+        Column('event_type', 'INT'),
+        Column('content_hash', 'TEXT'),
+    ],
+    primary_key=('id',),
+)
+
+
+def parse_datetime(value):
+    """Parses an ISO formatted string from the OW API into a naive UTC
+    datetime, which is what the ``TIMESTAMP`` columns of ``ow_events`` store."""
+    if value is None:
+        return None
+
+    dt = datetime.datetime.fromisoformat(value)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+    return dt
+
+
+def normalize_event(raw):
+    """Converts an event from the OW API into a row for ``ow_events``."""
+    attendance = raw.get('attendance_event')
+    if isinstance(attendance, dict):
+        registration_start = parse_datetime(attendance.get('registration_start'))
+    else:
+        registration_start = None
+
+    return {
+        'id': raw['id'],
+        'title': raw['title'],
+        'description': raw.get('description'),
+        'start_date': parse_datetime(raw['start_date']),
+        'end_date': parse_datetime(raw.get('end_date')),
+        'registration_start': registration_start,
+        'organizer': raw.get('organizer'),
+        'event_type': raw.get('event_type'),
+    }
+
+
+def content_hash(event):
+    """Returns a stable hash of the parts of an event we notify about."""
+    content = [event[c] for c in EventStore.HASHED_COLUMNS]
+    dumped = json.dumps(content, default=str, separators=(',', ':'))
+    return hashlib.sha1(dumped.encode()).hexdigest()
+
+
+class UpsertResult:
+    __slots__ = ('inserted', 'updated', 'unchanged')
+
+    def __init__(self, inserted=0, updated=0, unchanged=0):
+        self.inserted = inserted
+        self.updated = updated
+        self.unchanged = unchanged
+
+    def __repr__(self):
+        return (f'<UpsertResult inserted={self.inserted} updated={self.updated} '
+                f'unchanged={self.unchanged}>')
+
+
+class EventChangeSet:
+    """The events of a fetch whose content hash differed from the stored one."""
+
+    __slots__ = ('new', 'updated', 'unchanged')
+
+    def __init__(self, new=None, updated=None, unchanged=0):
+        self.new = new or []
+        self.updated = updated or []
+        self.unchanged = unchanged
+
+    def __bool__(self):
+        return bool(self.new or self.updated)
+
+    def __iter__(self):
+        yield from self.new
+        yield from self.updated
+
+    def __repr__(self):
+        return (f'<EventChangeSet new={len(self.new)} updated={len(self.updated)} '
+                f'unchanged={self.unchanged}>')
+
+
+class EventStore:
+    """Batched write access to the ``ow_events`` table.
+
+    A whole fetch result is written in a single transaction on a single
+    connection by copying it into a temporary staging table and merging
+    that into ``ow_events``.
+
+    The content hash of every stored event is kept in memory so a fetch
+    can be compared against it without touching the database, and only
+    events that actually changed are written.
+    """
+
+    COLUMNS = (
+        'id',
+        'title',
+        'description',
+        'start_date',
+        'end_date',
+        'registration_start',
+        'organizer',
+        'event_type',
+        'content_hash',
+    )
+    HASHED_COLUMNS = COLUMNS[1:-1]
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._hashes = None
+
+        columns = ', '.join(self.COLUMNS)
+        data_columns = self.COLUMNS[1:]
+        self._merge_query = (
+            f'INSERT INTO ow_events ({columns}, last_updated) '
+            f'SELECT DISTINCT ON (id) {columns}, last_updated FROM ow_events_staging ORDER BY id '
+            f'ON CONFLICT (id) DO UPDATE SET '
+            f'{", ".join(f"{c} = EXCLUDED.{c}" for c in data_columns)}, '
+            f'last_updated = EXCLUDED.last_updated '
+            f'WHERE ow_events.content_hash IS DISTINCT FROM EXCLUDED.content_hash '
+            f'RETURNING (xmax = 0) AS inserted;'
+        )
+        self._fetch_by_ids_query = (
+            f'SELECT {columns} FROM ow_events WHERE id = ANY($1::INTEGER[]);'
+        )
+
+    async def upsert_events(self, events, con=None) -> UpsertResult:
+        # Pages can shift while they are fetched concurrently, so the same
+        # event might show up twice in one batch.
+        unique = {e['id']: e for e in events}
+        if not unique:
+            return UpsertResult()
+
+        for event in unique.values():
+            if event.get('content_hash') is None:
+                event['content_hash'] = content_hash(event)
+
+        now = datetime.datetime.utcnow()
+        records = [
+            tuple(e[c] for c in self.COLUMNS) + (now,)
+            for e in unique.values()
+        ]
+
+        async with db.MaybeAcquire(con, self.bot.pool) as con:
+            async with con.transaction():
+                await con.execute(
+                    'CREATE TEMPORARY TABLE ow_events_staging '
+                    '(LIKE ow_events INCLUDING DEFAULTS) ON COMMIT DROP;'
+                )
+                await con.copy_records_to_table(
+                    'ow_events_staging',
+                    records=records,
+                    columns=self.COLUMNS + ('last_updated',),
+                )
+                rows = await con.fetch(self._merge_query)
+
+        if self._hashes is not None:
+            for event in unique.values():
+                self._hashes[event['id']] = event['content_hash']
+
+        inserted = sum(1 for r in rows if r['inserted'])
+        return UpsertResult(
+            inserted=inserted,
+            updated=len(rows) - inserted,
+            unchanged=len(unique) - len(rows),
+        )
+
+    async def fetch_hashes(self, con=None):
+        if self._hashes is None:
+            async with db.MaybeAcquire(con, self.bot.pool) as con:
+                rows = await con.fetch('SELECT id, content_hash FROM ow_events;')
+
+            self._hashes = {r['id']: r['content_hash'] for r in rows}
+
+        return self._hashes
+
+    async def store_changed_events(self, events, con=None) -> EventChangeSet:
+        """Writes only the events whose content hash differs from the stored
+        one and returns them as a change set."""
+        hashes = await self.fetch_hashes(con=con)
+
+        changes = EventChangeSet()
+        seen = set()
+        for event in events:
+            if event['id'] in seen:
+                continue
+            seen.add(event['id'])
+
+            event['content_hash'] = h = content_hash(event)
+            stored = hashes.get(event['id'])
+            if stored == h:
+                changes.unchanged += 1
+            elif event['id'] in hashes:
+                changes.updated.append(event)
+            else:
+                changes.new.append(event)
+
+        if changes:
+            await self.upsert_events(list(changes), con=con)
+
+        return changes
+
+    async def fetch_next_instant(self, after, con=None):
+        """Returns the first event start or registration opening after
+        ``after``, or ``None`` if there is none."""
+        async with db.MaybeAcquire(con, self.bot.pool) as con:
+            return await con.fetchval(
+                'SELECT min(instant) FROM ('
+                'SELECT start_date AS instant FROM ow_events '
+                'UNION ALL '
+                'SELECT registration_start FROM ow_events'
+                ') AS instants WHERE instant > $1;',
+                after,
+            )
+
+    async def fetch_events_by_ids(self, ids, con=None):
+        """Returns the stored events with the given ids mapped by id."""
+        async with db.MaybeAcquire(con, self.bot.pool) as con:
+            rows = await con.fetch(self._fetch_by_ids_query, list(ids))
+
+        return {r['id']: dict(r) for r in rows}
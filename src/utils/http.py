@@ -0,0 +1,86 @@
+from collections import OrderedDict
+
+
+class _CacheEntry:
+    __slots__ = ('etag', 'last_modified', 'data')
+
+    def __init__(self, etag, last_modified, data):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.data = data
+
+
+class ValidatorCache:
+    """Sends conditional GET requests through an :class:`aiohttp.ClientSession`.
+
+    The ``ETag`` and ``Last-Modified`` values of every response are stored
+    per url and query parameters. Following requests send them back as
+    ``If-None-Match``/``If-Modified-Since``, and on a ``304 Not Modified`` the
+    previously decoded result is returned without downloading or decoding
+    the body again.
+
+    The returned data is shared between calls and must not be mutated.
+    """
+
+    def __init__(self, session, max_entries=256):
+        self.session = session
+        self.max_entries = max_entries
+
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _get_key(url, params):
+        if not params:
+            return (url, ())
+        return (url, tuple(sorted((k, str(v)) for k, v in params.items())))
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    @property
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+        }
+
+    async def get_json(self, url, *, params=None, headers=None, **kwargs):
+        key = self._get_key(url, params)
+        entry = self._entries.get(key)
+
+        headers = dict(headers or {})
+        if entry is not None:
+            if entry.etag is not None:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified is not None:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        async with self.session.get(url, params=params, headers=headers, **kwargs) as response:
+            if response.status == 304 and entry is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry.data
+
+            response.raise_for_status()
+            data = await response.json()
+
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+
+        self.misses += 1
+        if etag is not None or last_modified is not None:
+            self._store(key, _CacheEntry(etag, last_modified, data))
+        else:
+            self._entries.pop(key, None)
+
+        return data
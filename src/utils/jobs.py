@@ -0,0 +1,127 @@
+import datetime
+
+from . import db
+from .migrations import Column, TableSchema
+
+JOBS_SCHEMA = TableSchema(
+    'ow_jobs',
+    [
+        Column('id', 'BIGSERIAL'),
+        Column('event_id', 'INTEGER NOT NULL'),
+        Column('kind', 'TEXT NOT NULL'),
+        Column('fire_at', 'TIMESTAMP NOT NULL'),
+        Column('done', 'BOOLEAN NOT NULL', default='FALSE'),
+    ],
+    primary_key=('id',),
+    constraints=['UNIQUE (event_id, kind)'],
+    indexes=['CREATE INDEX IF NOT EXISTS ow_jobs_fire_at_idx ON ow_jobs (fire_at) WHERE NOT done;'],
+)
+
+
+class JobStore:
+    """Durable storage of scheduled reminder jobs in the ``ow_jobs`` table.
+
+    A job is identified by ``(event_id, kind)``. Only jobs within the next
+    window are meant to be kept in memory. Due jobs are claimed with
+    ``FOR UPDATE SKIP LOCKED`` so several processes never fire the same job.
+
+    Done jobs are kept for ``retention`` after their fire time, so a job
+    can't be scheduled again right after it fired, and are deleted after.
+    """
+
+    def __init__(self, bot, batch_size=100, retention=datetime.timedelta(days=1)):
+        self.bot = bot
+        self.batch_size = batch_size
+        self.retention = retention
+
+    async def schedule(self, jobs, con=None):
+        """Creates or moves jobs given as ``(event_id, kind, fire_at)`` tuples.
+
+        A job whose fire time changes is marked as pending again.
+        """
+        if not jobs:
+            return
+
+        event_ids, kinds, fire_ats = zip(*jobs)
+        async with db.MaybeAcquire(con, self.bot.pool) as con:
+            await con.execute(
+                'INSERT INTO ow_jobs (event_id, kind, fire_at) '
+                'SELECT * FROM unnest($1::INTEGER[], $2::TEXT[], $3::TIMESTAMP[]) '
+                'ON CONFLICT (event_id, kind) DO UPDATE SET fire_at = EXCLUDED.fire_at, done = FALSE '
+                'WHERE ow_jobs.fire_at IS DISTINCT FROM EXCLUDED.fire_at;',
+                event_ids,
+                kinds,
+                fire_ats,
+            )
+
+    async def cancel(self, keys, con=None):
+        """Removes pending jobs given as ``(event_id, kind)`` tuples."""
+        if not keys:
+            return
+
+        event_ids, kinds = zip(*keys)
+        async with db.MaybeAcquire(con, self.bot.pool) as con:
+            await con.execute(
+                'DELETE FROM ow_jobs WHERE NOT done AND (event_id, kind) IN ('
+                'SELECT * FROM unnest($1::INTEGER[], $2::TEXT[]));',
+                event_ids,
+                kinds,
+            )
+
+    async def fetch_window(self, until, con=None):
+        """Returns every pending job that fires before ``until``, including
+        the ones that should already have fired."""
+        async with db.MaybeAcquire(con, self.bot.pool) as con:
+            return await con.fetch(
+                'SELECT id, event_id, kind, fire_at FROM ow_jobs '
+                'WHERE NOT done AND fire_at <= $1 ORDER BY fire_at;',
+                until,
+            )
+
+    async def run_due(self, now, handler):
+        """Claims due jobs in batches and passes them to ``handler``.
+
+        Each batch is marked as done in the same transaction it was claimed
+        in, so if ``handler`` raises the batch is left pending. Done jobs
+        older than the retention are deleted afterwards.
+
+        Parameters
+        ----------
+        handler: Callable[[List[:class:`asyncpg.Record`], :class:`asyncpg.Connection`], Awaitable[None]]
+            Called with every claimed batch and the connection holding it.
+
+        Returns
+        -------
+        :class:`int`
+            The amount of jobs that were handled.
+        """
+        handled = 0
+        async with self.bot.pool.acquire() as con:
+            while True:
+                async with con.transaction():
+                    jobs = await con.fetch(
+                        'SELECT id, event_id, kind, fire_at FROM ow_jobs '
+                        'WHERE NOT done AND fire_at <= $1 ORDER BY fire_at LIMIT $2 '
+                        'FOR UPDATE SKIP LOCKED;',
+                        now,
+                        self.batch_size,
+                    )
+                    if not jobs:
+                        break
+
+                    await handler(jobs, con)
+                    await con.execute(
+                        'UPDATE ow_jobs SET done = TRUE WHERE id = ANY($1::BIGINT[]);',
+                        [j['id'] for j in jobs],
+                    )
+
+                handled += len(jobs)
+                if len(jobs) < self.batch_size:
+                    break
+
+            await con.execute(
+                'DELETE FROM ow_jobs WHERE done AND fire_at < $1;',
+                now - self.retention,
+            )
+
+        return handled
@@ -0,0 +1,99 @@
+from . import db
+from .migrations import Column, TableSchema
+
+MESSAGES_SCHEMA = TableSchema(
+    'notification_messages',
+    [
+        Column('event_id', 'INTEGER NOT NULL'),
+        Column('channel_id', 'BIGINT NOT NULL'),
+        Column('message_id', 'BIGINT NOT NULL'),
+        Column('recipient_id', 'BIGINT'),
+    ],
+    primary_key=('channel_id', 'message_id'),
+    indexes=[
+        'CREATE INDEX IF NOT EXISTS notification_messages_event_id_idx '
+        'ON notification_messages (event_id);',
+    ],
+)
+
+
+class NotificationMessageStore:
+    """Keeps track of the messages posted about each event.
+
+    Rows live in the ``notification_messages`` table and are loaded into
+    memory per event the first time that event is looked up. A message is
+    mapped by the destination it was sent to, so an update can be edited
+    into the existing message instead of posting a new one.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._messages = {}  # event id -> {destination: (channel_id, message_id)}
+
+    @staticmethod
+    def _get_destination(row):
+        if row['recipient_id'] is not None:
+            return ('user', row['recipient_id'])
+        return ('channel', row['channel_id'])
+
+    async def get_many(self, event_ids, con=None):
+        """Returns a mapping of event id to the messages posted about it."""
+        missing = [i for i in event_ids if i not in self._messages]
+        if missing:
+            async with db.MaybeAcquire(con, self.bot.pool) as con:
+                rows = await con.fetch(
+                    'SELECT event_id, channel_id, message_id, recipient_id '
+                    'FROM notification_messages WHERE event_id = ANY($1::INTEGER[]);',
+                    missing,
+                )
+
+            for event_id in missing:
+                self._messages[event_id] = {}
+            for row in rows:
+                self._messages[row['event_id']][self._get_destination(row)] = (
+                    row['channel_id'],
+                    row['message_id'],
+                )
+
+        return {i: self._messages[i] for i in event_ids}
+
+    async def add(self, event_id, destination, message, con=None):
+        kind, id_ = destination
+        recipient_id = id_ if kind == 'user' else None
+
+        async with db.MaybeAcquire(con, self.bot.pool) as con:
+            await con.execute(
+                'INSERT INTO notification_messages (event_id, channel_id, message_id, recipient_id) '
+                'VALUES ($1, $2, $3, $4) ON CONFLICT DO NOTHING;',
+                event_id,
+                message.channel.id,
+                message.id,
+                recipient_id,
+            )
+
+        messages = self._messages.get(event_id)
+        if messages is not None:
+            messages[destination] = (message.channel.id, message.id)
+
+    async def remove(self, event_id, destination, con=None):
+        messages = self._messages.get(event_id)
+        if messages is None:
+            messages = (await self.get_many((event_id,), con=con))[event_id]
+
+        try:
+            channel_id, message_id = messages.pop(destination)
+        except KeyError:
+            return
+
+        async with db.MaybeAcquire(con, self.bot.pool) as con:
+            await con.execute(
+                'DELETE FROM notification_messages WHERE channel_id = $1 AND message_id = $2;',
+                channel_id,
+                message_id,
+            )
+
+    def retain(self, event_ids):
+        """Drops the in-memory messages of every event not in ``event_ids``."""
+        event_ids = set(event_ids)
+        for event_id in [i for i in self._messages if i not in event_ids]:
+            del self._messages[event_id]
@@ -0,0 +1,210 @@
+import asyncio
+import datetime
+import hashlib
+import json
+
+from . import db
+
+
+def sql_literal(value):
+    """Renders a python value as an SQL literal for use in DDL, where
+    parameters can't be used."""
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+
+    value = str(value).replace("'", "''")
+    return f"'{value}'"
+
+
+class Column:
+    __slots__ = ('name', 'sql_type', 'default', 'using')
+
+    def __init__(self, name, sql_type, default=None, using=None):
+        """``default`` is an SQL expression, see :func:`sql_literal`.
+
+        ``using`` is the expression converting an existing column of another
+        type. Without it the type of an existing column is never changed.
+        """
+        self.name = name
+        self.sql_type = sql_type
+        self.default = default
+        self.using = using
+
+    @property
+    def type_name(self):
+        """The type as named by ``information_schema.columns.data_type``."""
+        return self.sql_type.split()[0].lower()
+
+    def definition(self):
+        if self.default is None:
+            return f'{self.name} {self.sql_type}'
+        return f'{self.name} {self.sql_type} DEFAULT {self.default}'
+
+
+class TableSchema:
+    """The desired shape of a table.
+
+    Parameters
+    ----------
+    name: :class:`str`
+        The table name.
+    columns: List[:class:`Column`]
+        The columns of the table.
+    primary_key: Tuple[:class:`str`]
+        The primary key columns, if any.
+    constraints: List[:class:`str`]
+        Extra table constraints used when the table is created.
+    indexes: List[:class:`str`]
+        ``CREATE INDEX IF NOT EXISTS`` statements.
+    """
+
+    def __init__(self, name, columns, *, primary_key=(), constraints=(), indexes=()):
+        self.name = name
+        self.columns = list(columns)
+        self.primary_key = tuple(primary_key)
+        self.constraints = list(constraints)
+        self.indexes = list(indexes)
+
+    @property
+    def fingerprint(self):
+        dumped = json.dumps([
+            [c.definition() for c in self.columns],
+            self.primary_key,
+            self.constraints,
+            self.indexes,
+        ])
+        return hashlib.sha1(dumped.encode()).hexdigest()
+
+    def create_statement(self):
+        parts = [c.definition() for c in self.columns]
+        if self.primary_key:
+            parts.append(f'PRIMARY KEY ({", ".join(self.primary_key)})')
+        parts.extend(self.constraints)
+
+        return f'CREATE TABLE IF NOT EXISTS {self.name} ({", ".join(parts)});'
+
+
+class MigrationEngine:
+    """Brings tables up to date with their :class:`TableSchema`.
+
+    The fingerprint of every applied schema is stored in the
+    ``schema_migrations`` table, which is read once. A schema whose
+    fingerprint matches needs no further queries. Otherwise the existing
+    columns are read from ``information_schema`` in one query, the table is
+    created or altered in a single statement and the indexes are created.
+
+    Columns with a ``using`` expression are converted when their type
+    differs.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+
+        self._fingerprints = None
+        self._lock = asyncio.Lock()
+
+    async def _fetch_fingerprints(self, con):
+        async with self._lock:
+            if self._fingerprints is None:
+                await con.execute(
+                    'CREATE TABLE IF NOT EXISTS schema_migrations ('
+                    'name TEXT PRIMARY KEY,'
+                    'fingerprint TEXT NOT NULL,'
+                    'applied_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE \'utc\')'
+                    ');'
+                )
+                rows = await con.fetch('SELECT name, fingerprint FROM schema_migrations;')
+                self._fingerprints = {r['name']: r['fingerprint'] for r in rows}
+
+        return self._fingerprints
+
+    async def migrate_all(self, schemas, con=None):
+        async with db.MaybeAcquire(con, self.bot.pool) as con:
+            for schema in schemas:
+                await self.migrate(schema, con=con)
+
+    async def migrate(self, schema, con=None):
+        """Migrates the table of ``schema``. Returns whether anything had to
+        be done."""
+        async with db.MaybeAcquire(con, self.bot.pool) as con:
+            fingerprints = await self._fetch_fingerprints(con)
+            fingerprint = schema.fingerprint
+            if fingerprints.get(schema.name) == fingerprint:
+                return False
+
+            async with con.transaction():
+                # Keeps several processes from migrating the same table at once.
+                await con.execute('SELECT pg_advisory_xact_lock(hashtext($1));', schema.name)
+
+                rows = await con.fetch(
+                    'SELECT column_name, data_type FROM information_schema.columns '
+                    'WHERE table_schema = current_schema() AND table_name = $1;',
+                    schema.name,
+                )
+                if not rows:
+                    await con.execute(schema.create_statement())
+                else:
+                    await self._alter_table(con, schema, {r['column_name']: r['data_type'] for r in rows})
+
+                for statement in schema.indexes:
+                    await con.execute(statement)
+
+                await con.execute(
+                    'INSERT INTO schema_migrations (name, fingerprint) VALUES ($1, $2) '
+                    'ON CONFLICT (name) DO UPDATE SET fingerprint = EXCLUDED.fingerprint, '
+                    'applied_at = EXCLUDED.applied_at;',
+                    schema.name,
+                    fingerprint,
+                )
+
+            fingerprints[schema.name] = fingerprint
+            return True
+
+    async def _alter_table(self, con, schema, existing):
+        actions = []
+        for column in schema.columns:
+            if column.name not in existing:
+                # Added with the default so existing rows are filled in
+                # without rewriting the table.
+                actions.append(f'ADD COLUMN IF NOT EXISTS {column.definition()}')
+                continue
+
+            if column.using is not None and existing[column.name] != column.type_name:
+                # The old default might not cast to the new type.
+                actions.append(f'ALTER COLUMN {column.name} DROP DEFAULT')
+                actions.append(f'ALTER COLUMN {column.name} TYPE {column.sql_type} USING {column.using}')
+
+            if column.default is not None:
+                actions.append(f'ALTER COLUMN {column.name} SET DEFAULT {column.default}')
+
+        if actions:
+            await con.execute(f'ALTER TABLE {schema.name} {", ".join(actions)};')
+
+        if schema.primary_key:
+            await self._ensure_primary_key(con, schema)
+
+    async def _ensure_primary_key(self, con, schema):
+        """Adds the primary key to tables created before it was one,
+        removing duplicate rows first."""
+        query = ('SELECT EXISTS (SELECT 1 FROM pg_index '
+                 'WHERE indrelid = $1::regclass AND indisprimary);')
+        if await con.fetchval(query, schema.name):
+            return
+
+        keys = schema.primary_key
+        matches = ' AND '.join(f'a.{k} = b.{k}' for k in keys)
+        nulls = ' OR '.join(f'{k} IS NULL' for k in keys)
+        await con.execute(
+            f'DELETE FROM {schema.name} a USING {schema.name} b '
+            f'WHERE {matches} AND a.ctid < b.ctid;'
+        )
+        await con.execute(f'DELETE FROM {schema.name} WHERE {nulls};')
+        await con.execute(f'ALTER TABLE {schema.name} ADD PRIMARY KEY ({", ".join(keys)});')
@@ -0,0 +1,85 @@
+class PrefixTable:
+    """Prebuilt command prefixes of every guild, mention prefixes included.
+
+    :meth:`get` is synchronous. It returns the prefixes already built, or
+    builds them from the cached config, e.g. one loaded by a prewarm, so
+    only guilds whose config isn't cached need :meth:`fetch`. Entries are
+    dropped whenever the prefixes field is updated or the config is evicted.
+
+    Parameters
+    ----------
+    config: :class:`BaseConfig`
+        The config holding the prefixes.
+    key: :class:`str`
+        The key of the prefixes field.
+    default: List[:class:`str`]
+        The prefixes used outside of guilds.
+    """
+
+    def __init__(self, bot, config, key, default):
+        self.bot = bot
+        self.config = config
+        self.key = key
+        self.default = tuple(default)
+
+        self._prefixes = {}
+        self._mentions = None
+        self._default_prefixes = None
+        self._generation = 0
+
+        config.add_update_listener(self.on_config_update)
+        config.add_evict_listener(self.invalidate)
+
+    def __len__(self):
+        return len(self._prefixes)
+
+    def _build(self, prefixes):
+        if self._mentions is None:
+            user_id = self.bot.user.id
+            self._mentions = (f'<@{user_id}> ', f'<@!{user_id}> ')
+
+        return self._mentions + tuple(prefixes)
+
+    @property
+    def default_prefixes(self):
+        if self._default_prefixes is None:
+            self._default_prefixes = self._build(self.default)
+        return self._default_prefixes
+
+    def get(self, guild_id):
+        """Returns the prebuilt prefixes of a guild, or ``None`` if they have
+        to be fetched with :meth:`fetch`."""
+        prefixes = self._prefixes.get(guild_id)
+        if prefixes is not None:
+            return prefixes
+
+        if self.config.get_field(self.key).always_reload:
+            return None
+
+        data = self.config.peek_config(guild_id)
+        if data is None:
+            return None
+
+        prefixes = self._prefixes[guild_id] = self._build(data.get(self.key))
+        return prefixes
+
+    async def fetch(self, guild_id):
+        generation = self._generation
+        prefixes = self._build(await self.config.safe_fetch_field(guild_id, self.key))
+
+        # Don't store prefixes which were invalidated while fetching them.
+        if generation == self._generation:
+            self._prefixes[guild_id] = prefixes
+
+        return prefixes
+
+    def invalidate(self, guild_id=None):
+        self._generation += 1
+        if guild_id is None:
+            self._prefixes.clear()
+        else:
+            self._prefixes.pop(guild_id, None)
+
+    async def on_config_update(self, guild_id, keys):
+        if self.key in keys:
+            self.invalidate(guild_id)
@@ -0,0 +1,130 @@
+import datetime
+import discord
+
+from collections import OrderedDict
+from . import utils
+
+EVENT_PAGE_URL = 'https://online.ntnu.no/events/{}'
+
+
+def _as_utc(dt):
+    return dt.replace(tzinfo=datetime.timezone.utc)
+
+
+def render_event_embed(event, *, header=None, color=None, tzinfo=None):
+    """Returns the embed payload dict of an event notification."""
+    description = event['description'] or ''
+    if len(description) > 300:
+        description = description[:297] + '...'
+
+    if tzinfo is None:
+        # astimezone(None) would use the timezone of the host.
+        tzinfo = datetime.timezone.utc
+
+    start_date = _as_utc(event['start_date'])
+    embed = utils.create_embed(
+        description,
+        title=event['title'],
+        url=EVENT_PAGE_URL.format(event['id']),
+        color=color,
+        header=header,
+        footer=utils.strftime(start_date.astimezone(tzinfo), timezone=True),
+    )
+    embed.add_field(name='Starts', value=discord.utils.format_dt(start_date, 'F'))
+
+    if event['registration_start'] is not None:
+        embed.add_field(
+            name='Registration opens',
+            value=discord.utils.format_dt(_as_utc(event['registration_start']), 'R'),
+        )
+
+    return embed.to_dict()
+
+
+class _RenderedEvent:
+    __slots__ = ('payload', 'embed', 'expires_at')
+
+    def __init__(self, payload, expires_at):
+        self.payload = payload
+        self.embed = discord.Embed.from_dict(payload)
+        self.expires_at = expires_at
+
+
+class EmbedRenderCache:
+    """Renders every version of an event notification only once.
+
+    Entries are keyed by ``(event_id, content_hash, header, timezone)`` and
+    the same :class:`discord.Embed` is handed out for every destination the
+    notification is sent to. A new version of an event replaces the older
+    ones, the least recently used entries are evicted past ``max_entries``
+    and :meth:`evict_past` drops events which have ended.
+    """
+
+    def __init__(self, *, color=None, tzinfo=None, max_entries=512):
+        self.color = color
+        self.tzinfo = tzinfo
+        self.max_entries = max_entries
+
+        self._entries = OrderedDict()
+        self._versions = {}  # event id -> content hash of the cached entries
+        self._event_keys = {}  # event id -> keys of the cached entries
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get_key(self, event, header, tzinfo):
+        return (event['id'], event['content_hash'], header, tzinfo.tzname(None))
+
+    def _drop_event(self, event_id):
+        self._versions.pop(event_id, None)
+        for key in self._event_keys.pop(event_id, ()):
+            del self._entries[key]
+
+    def _drop_key(self, key):
+        del self._entries[key]
+
+        keys = self._event_keys[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._event_keys[key[0]]
+            del self._versions[key[0]]
+
+    def get_payload(self, event, *, header=None, tzinfo=None):
+        return self._get(event, header, tzinfo).payload
+
+    def get_embed(self, event, *, header=None, tzinfo=None):
+        return self._get(event, header, tzinfo).embed
+
+    def _get(self, event, header, tzinfo):
+        tzinfo = tzinfo or self.tzinfo or datetime.timezone.utc
+        key = self._get_key(event, header, tzinfo)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+
+        self.misses += 1
+        if self._versions.get(event['id'], event['content_hash']) != event['content_hash']:
+            self._drop_event(event['id'])
+
+        payload = render_event_embed(event, header=header, color=self.color, tzinfo=tzinfo)
+        entry = self._entries[key] = _RenderedEvent(
+            payload,
+            event['end_date'] or event['start_date'],
+        )
+        self._versions[event['id']] = event['content_hash']
+        self._event_keys.setdefault(event['id'], set()).add(key)
+
+        while len(self._entries) > self.max_entries:
+            self._drop_key(next(iter(self._entries)))
+
+        return entry
+
+    def evict_past(self, now=None):
+        now = now or datetime.datetime.utcnow()
+        for key in [k for k, e in self._entries.items() if e.expires_at < now]:
+            self._drop_key(key)
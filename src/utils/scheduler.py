@@ -0,0 +1,189 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+import random
+
+logger = logging.getLogger(__name__)
+
+
+class PollScheduler:
+    """Picks the delay until the next poll of the OW API.
+
+    Polls are done every ``min_interval`` seconds while a known instant
+    (an event start or a registration opening) is within ``hot_window``
+    seconds, either ahead or just passed. Otherwise the scheduler sleeps
+    until that window is entered, but never longer than ``max_interval``.
+    Every delay gets a bit of jitter added.
+    """
+
+    def __init__(self, *,
+                 min_interval=30,
+                 max_interval=30 * 60,
+                 hot_window=15 * 60,
+                 jitter=0.1):
+        if min_interval > max_interval:
+            raise ValueError('min_interval must not exceed max_interval.')
+
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.hot_window = hot_window
+        self.jitter = jitter
+
+    def window_start(self, now=None):
+        """Returns the earliest instant that still affects the next delay."""
+        now = now or datetime.datetime.utcnow()
+        return now - datetime.timedelta(seconds=self.hot_window)
+
+    def _apply_jitter(self, delay):
+        delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return max(self.min_interval, min(self.max_interval, delay))
+
+    def next_delay(self, next_instant=None, now=None):
+        """Returns the amount of seconds to sleep before the next poll.
+
+        ``next_instant`` is the first known instant after :meth:`window_start`
+        or ``None`` if nothing is scheduled.
+        """
+        if next_instant is None:
+            return self._apply_jitter(self.max_interval)
+
+        now = now or datetime.datetime.utcnow()
+        until = (next_instant - now).total_seconds()
+        if until <= self.hot_window:
+            return self._apply_jitter(self.min_interval)
+
+        return self._apply_jitter(until - self.hot_window)
+
+
+class Reminder:
+    __slots__ = ('key', 'fire_at', 'payload', 'cancelled')
+
+    def __init__(self, key, fire_at, payload=None):
+        self.key = key
+        self.fire_at = fire_at
+        self.payload = payload
+        self.cancelled = False
+
+    def __repr__(self):
+        return f'<Reminder key={self.key!r} fire_at={self.fire_at}>'
+
+
+class ReminderScheduler:
+    """Fires reminders at their scheduled time from a single task.
+
+    Reminders are kept in a heap ordered by fire time and keyed by an
+    arbitrary hashable key, so scheduling a key again moves the existing
+    reminder. Cancelled reminders are only marked and dropped once they
+    reach the top of the heap, or when they make up more than half of it.
+
+    Parameters
+    ----------
+    callback: Callable[[List[:class:`Reminder`]], Awaitable[None]]
+        Called with every reminder that is due in one batch.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+        self._heap = []
+        self._reminders = {}
+        self._cancelled = 0
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return len(self._reminders)
+
+    def __contains__(self, key):
+        return key in self._reminders
+
+    def get(self, key):
+        return self._reminders.get(key)
+
+    def schedule(self, key, fire_at, payload=None):
+        self.cancel(key)
+
+        reminder = Reminder(key, fire_at, payload)
+        self._reminders[key] = reminder
+        heapq.heappush(self._heap, (fire_at, next(self._counter), reminder))
+
+        if self._heap[0][2] is reminder:
+            self._wakeup.set()
+
+        return reminder
+
+    def cancel(self, key):
+        reminder = self._reminders.pop(key, None)
+        if reminder is None:
+            return None
+
+        reminder.cancelled = True
+        self._cancelled += 1
+        if self._cancelled > len(self._heap) // 2:
+            self._compact()
+
+        return reminder
+
+    def clear(self):
+        self._heap.clear()
+        self._reminders.clear()
+        self._cancelled = 0
+
+    def _compact(self):
+        self._heap = [e for e in self._heap if not e[2].cancelled]
+        heapq.heapify(self._heap)
+        self._cancelled = 0
+
+    def _peek(self):
+        while self._heap and self._heap[0][2].cancelled:
+            heapq.heappop(self._heap)
+            self._cancelled -= 1
+
+        return self._heap[0][2] if self._heap else None
+
+    def _pop_due(self, now):
+        due = []
+        while True:
+            reminder = self._peek()
+            if reminder is None or reminder.fire_at > now:
+                return due
+
+            heapq.heappop(self._heap)
+            del self._reminders[reminder.key]
+            due.append(reminder)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+
+            reminder = self._peek()
+            if reminder is None:
+                await self._wakeup.wait()
+                continue
+
+            now = datetime.datetime.utcnow()
+            delay = (reminder.fire_at - now).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due = self._pop_due(now)
+            try:
+                await self.callback(due)
+            except Exception:
+                logger.exception(f'Failed to fire {len(due)} reminders.')
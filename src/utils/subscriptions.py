@@ -0,0 +1,127 @@
+import re
+
+from collections import defaultdict
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return TOKEN_RE.findall(text.lower())
+
+
+class SubscriptionIndex:
+    """An inverted index from event properties to subscribers.
+
+    Subscribers are any hashable value, for example ``('guild', id)``.
+    Every subscriber is indexed by the organizer ids it follows and by the
+    first token of each keyword phrase it follows, so matching an event only
+    looks at subscribers that share at least one term with it. Subscribers
+    added with ``match_all`` receive every event.
+    """
+
+    def __init__(self):
+        self._organizers = defaultdict(set)
+        self._keywords = defaultdict(set)
+        self._match_all = set()
+
+        # subscriber -> (organizers, keyword phrases as token tuples, match_all)
+        self._subscriptions = {}
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def __contains__(self, subscriber):
+        return subscriber in self._subscriptions
+
+    def clear(self):
+        self._organizers.clear()
+        self._keywords.clear()
+        self._match_all.clear()
+        self._subscriptions.clear()
+
+    def set(self, subscriber, *, organizers=(), keywords=(), match_all=False):
+        """Adds or replaces the filters of a subscriber."""
+        self.remove(subscriber)
+
+        organizers = frozenset(organizers)
+        phrases = frozenset(p for p in (tuple(tokenize(k)) for k in keywords) if p)
+        if not (organizers or phrases or match_all):
+            return
+
+        self._subscriptions[subscriber] = (organizers, phrases, match_all)
+
+        if match_all:
+            self._match_all.add(subscriber)
+            return
+
+        for organizer in organizers:
+            self._organizers[organizer].add(subscriber)
+        for phrase in phrases:
+            self._keywords[phrase[0]].add(subscriber)
+
+    def remove(self, subscriber):
+        try:
+            organizers, phrases, match_all = self._subscriptions.pop(subscriber)
+        except KeyError:
+            return
+
+        if match_all:
+            self._match_all.discard(subscriber)
+            return
+
+        for organizer in organizers:
+            self._discard(self._organizers, organizer, subscriber)
+        for phrase in phrases:
+            self._discard(self._keywords, phrase[0], subscriber)
+
+    @staticmethod
+    def _discard(index, term, subscriber):
+        subscribers = index.get(term)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del index[term]
+
+    @staticmethod
+    def _contains_phrase(tokens, phrase):
+        size = len(phrase)
+        if size == 1:
+            return True
+
+        for i in range(len(tokens) - size + 1):
+            if tuple(tokens[i:i + size]) == phrase:
+                return True
+        return False
+
+    def match(self, event):
+        """Returns the set of subscribers interested in an event."""
+        matched = set(self._match_all)
+
+        organizer_hits = self._organizers.get(event.get('organizer'))
+        if organizer_hits:
+            matched |= organizer_hits
+
+        tokens = tokenize(event.get('title'))
+        for token in set(tokens):
+            for subscriber in self._keywords.get(token, ()):
+                if subscriber in matched:
+                    continue
+
+                phrases = self._subscriptions[subscriber][1]
+                if any(p[0] == token and self._contains_phrase(tokens, p) for p in phrases):
+                    matched.add(subscriber)
+
+        return matched
+
+    def match_many(self, events):
+        """Returns a mapping of event id to the subscribers of that event.
+        Events without subscribers are left out."""
+        result = {}
+        for event in events:
+            matched = self.match(event)
+            if matched:
+                result[event['id']] = matched
+
+        return result
@@ -192,6 +192,25 @@ def cmp_embeds(a: discord.Embed, b: discord.Embed, *, exclude: list = []):
             if a_field['inline'] != b_field['inline']:
                 return False
 
+    return True
+
+
+def create_embed(message=None, *,
+                 title=None,
+                 url=None,
+                 color=None,
+                 header=None,
+                 footer=None):
+    embed = discord.Embed(title=title, url=url, color=color, description=message)
+
+    if header is not None:
+        embed.set_author(name=header)
+
+    if footer is not None:
+        embed.set_footer(text=footer)
+
+    return embed
+
 
 class LockEvent(asyncio.Lock):
     def __init__(self) -> None:
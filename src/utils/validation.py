@@ -0,0 +1,163 @@
+import asyncio
+import datetime
+import logging
+
+from . import db, utils
+from .config import ConfigError
+from .migrations import Column, TableSchema
+
+logger = logging.getLogger(__name__)
+
+ISSUES_SCHEMA = TableSchema(
+    'config_validation_issues',
+    [
+        Column('config', 'TEXT NOT NULL'),
+        Column('identifier', 'BIGINT NOT NULL'),
+        Column('invalid_fields', 'JSONB NOT NULL'),
+        Column('checked_at', 'TIMESTAMP NOT NULL'),
+    ],
+    primary_key=('config', 'identifier'),
+)
+
+
+class ConfigValidationSweep:
+    """Periodically validates every stored config and records the ones with
+    invalid fields, e.g. a deleted channel or role, in the
+    ``config_validation_issues`` table.
+
+    Each config table is read through a server-side cursor in batches on a
+    single connection, which also records the results. At most
+    ``concurrency`` tables are swept at once, so the sweep never holds more
+    than that many connections of the pool. Rows are validated in memory
+    and the event loop is yielded to every ``yield_every`` rows.
+
+    Parameters
+    ----------
+    managers: List[:class:`ConfigManager`]
+        The managers whose configs are swept.
+    interval: :class:`float`
+        Seconds between sweeps.
+    """
+
+    def __init__(self, bot, managers, *,
+                 interval=6 * 60 * 60,
+                 batch_size=500,
+                 concurrency=1,
+                 yield_every=50):
+        self.bot = bot
+        self.managers = managers
+        self.interval = interval
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.yield_every = yield_every
+
+        self.last_run = None
+        self.last_results = {}
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    def start(self):
+        if self._task is None:
+            self._task = utils.create_tracebacked_task(self._runner())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _runner(self):
+        await self.bot.wait_until_ready()
+        while True:
+            try:
+                await self.run()
+            except Exception:
+                logger.exception('Config validation sweep failed.')
+
+            await asyncio.sleep(self.interval)
+
+    async def run(self):
+        """Sweeps every config once. Returns the amount of checked and
+        invalid configs mapped by table name."""
+        async with self._lock:
+            semaphore = asyncio.Semaphore(self.concurrency)
+            configs = [c for m in self.managers for c in m.configs]
+            results = await asyncio.gather(*[self._sweep_config(c, semaphore) for c in configs])
+
+            self.last_run = datetime.datetime.utcnow()
+            self.last_results = {c.table_name: r for c, r in zip(configs, results)}
+            logger.info(f'Config validation sweep done: {self.last_results}')
+            return self.last_results
+
+    async def _sweep_config(self, cfg, semaphore):
+        checked = 0
+        invalid = 0
+        async with semaphore:
+            started = datetime.datetime.utcnow()
+            async with self.bot.pool.acquire() as con:
+                async with con.transaction():
+                    cursor = await con.cursor(f'SELECT * FROM {cfg.table_name};')
+                    while True:
+                        rows = await cursor.fetch(self.batch_size)
+                        if not rows:
+                            break
+
+                        issues = await self._validate_rows(cfg, rows)
+                        if issues:
+                            await self._record(con, cfg, issues, started)
+
+                        checked += len(rows)
+                        invalid += len(issues)
+
+                    # Configs not recorded by this sweep are valid again.
+                    await con.execute(
+                        'DELETE FROM config_validation_issues WHERE config = $1 AND checked_at < $2;',
+                        cfg.table_name,
+                        started,
+                    )
+
+        return {'checked': checked, 'invalid': invalid}
+
+    async def _validate_rows(self, cfg, rows):
+        issues = []
+        for i, row in enumerate(rows, 1):
+            if i % self.yield_every == 0:
+                await asyncio.sleep(0)
+
+            try:
+                data = cfg.load_row(row)
+            except ConfigError:
+                # The bot is not in the guild anymore.
+                continue
+            except Exception:
+                logger.exception(f'Failed to load {cfg.table_name} row {row["identifier"]}.')
+                continue
+
+            keys = cfg.get_invalid_fields(data)
+            if keys:
+                issues.append((row['identifier'], keys))
+
+        return issues
+
+    async def _record(self, con, cfg, issues, checked_at):
+        identifiers, keys = zip(*issues)
+        # Passed as text, asyncpg would read the lists of keys as sub-arrays
+        # of a JSONB[] instead of as single elements.
+        await con.execute(
+            'INSERT INTO config_validation_issues (config, identifier, invalid_fields, checked_at) '
+            'SELECT $1, identifier, invalid_fields::JSONB, $4 '
+            'FROM unnest($2::BIGINT[], $3::TEXT[]) AS issues (identifier, invalid_fields) '
+            'ON CONFLICT (config, identifier) DO UPDATE SET '
+            'invalid_fields = EXCLUDED.invalid_fields, checked_at = EXCLUDED.checked_at;',
+            cfg.table_name,
+            identifiers,
+            [db.json_dumps(k) for k in keys],
+            checked_at,
+        )
+
+    async def fetch_issues(self, limit=50, con=None):
+        async with db.MaybeAcquire(con, self.bot.pool) as con:
+            return await con.fetch(
+                'SELECT config, identifier, invalid_fields, checked_at FROM config_validation_issues '
+                'ORDER BY config, identifier LIMIT $1;',
+                limit,
+            )